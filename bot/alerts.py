@@ -0,0 +1,176 @@
+import json
+import math
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime
+
+ALERT_LOG_BATCH_SIZE = 100
+
+CREATE_ALERT_EVENTS_TABLE = '''
+CREATE TABLE IF NOT EXISTS alert_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    rule_id INTEGER,
+    user_id INTEGER,
+    message TEXT,
+    read_at TIMESTAMP,
+    enqueued_at TIMESTAMP,
+    sent_at TIMESTAMP,
+    result TEXT,
+    retries INTEGER DEFAULT 0
+)
+'''
+
+CREATE_ALERT_EVENTS_INDEX = '''
+CREATE INDEX IF NOT EXISTS alert_events_user_id
+ON alert_events (user_id, id)
+'''
+
+INSERT_ALERT_EVENT = '''
+INSERT INTO alert_events (
+    rule_id,
+    user_id,
+    message,
+    read_at,
+    enqueued_at,
+    sent_at,
+    result,
+    retries
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+SELECT_USER_ALERT_EVENTS = '''
+SELECT message, read_at, sent_at, result, retries
+FROM alert_events
+WHERE user_id=?
+ORDER BY id DESC
+LIMIT ?
+'''
+
+# Задержка от показания датчика до отправки в Telegram, секунды
+SELECT_ALERT_LATENCIES = '''
+SELECT (julianday(sent_at) - julianday(read_at)) * 86400 AS latency
+FROM alert_events
+WHERE sent_at >= ? AND result = 'ok'
+ORDER BY latency
+'''
+
+
+@dataclass(slots=True)
+class Alert:
+    rule_id: int
+    user_id: int
+    message: str
+    urgent: bool
+    read_at: datetime
+    enqueued_at: datetime | None = None
+    sent_at: datetime | None = None
+    result: str | None = None
+    retries: int = 0
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def _fromisoformat(value):
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+def alert_key(alert):
+    """Ключ идемпотентности: одно правило, одно показание."""
+    return f'{alert.rule_id}:{alert.user_id}:{alert.read_at.isoformat()}'
+
+
+def alerts_to_json(alerts):
+    return json.dumps([
+        (
+            alert.rule_id,
+            alert.user_id,
+            alert.message,
+            alert.urgent,
+            _isoformat(alert.read_at),
+            _isoformat(alert.enqueued_at),
+        )
+        for alert in alerts
+    ], ensure_ascii=False)
+
+
+def alerts_from_json(text):
+    return [
+        Alert(
+            rule_id=rule_id,
+            user_id=user_id,
+            message=message,
+            urgent=urgent,
+            read_at=_fromisoformat(read_at),
+            enqueued_at=_fromisoformat(enqueued_at),
+        )
+        for rule_id, user_id, message, urgent, read_at, enqueued_at
+        in json.loads(text)
+    ]
+
+
+class AlertLog:
+    """Журнал сработавших уведомлений.
+
+    События копятся в памяти и записываются пачками по batch_size или
+    при явном вызове flush().
+    """
+
+    def __init__(self, database_path, batch_size=ALERT_LOG_BATCH_SIZE):
+        self.database_path = database_path
+        self.batch_size = batch_size
+        self._pending = []
+
+    def record(self, alert):
+        self._pending.append((
+            alert.rule_id,
+            alert.user_id,
+            alert.message,
+            _isoformat(alert.read_at),
+            _isoformat(alert.enqueued_at),
+            _isoformat(alert.sent_at),
+            alert.result,
+            alert.retries,
+        ))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+
+        # Список подменяется до записи: flush() может выполняться в
+        # потоке, пока event loop вызывает record()
+        pending, self._pending = self._pending, []
+        con = sqlite3.connect(self.database_path)
+        with con:
+            con.executemany(INSERT_ALERT_EVENT, pending)
+        con.close()
+
+    def recent(self, user_id, limit=10):
+        self.flush()
+        con = sqlite3.connect(self.database_path)
+        with con:
+            rows = con.execute(
+                SELECT_USER_ALERT_EVENTS, (user_id, limit)).fetchall()
+        con.close()
+        return rows
+
+    def latency_percentiles(self, since, percentiles=(50, 90, 99)):
+        """Перцентили задержки доставки (nearest-rank) начиная с since."""
+        self.flush()
+        con = sqlite3.connect(self.database_path)
+        with con:
+            latencies = [
+                row[0] for row in
+                con.execute(SELECT_ALERT_LATENCIES, (since.isoformat(),))
+            ]
+        con.close()
+
+        if not latencies:
+            return {}
+        return {
+            p: latencies[max(math.ceil(p / 100 * len(latencies)) - 1, 0)]
+            for p in percentiles
+        }
@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+from datetime import datetime
+
+from aiohttp import WSCloseCode, web
+
+logger = logging.getLogger(__name__)
+
+# Очередь на одного WebSocket-клиента: медленный клиент теряет старые
+# показания, но не задерживает остальных
+WS_CLIENT_QUEUE_SIZE = 16
+WS_HEARTBEAT = 30
+
+MAX_RANGE_ROWS = 10_000
+
+SELECT_READINGS_RANGE = '''
+SELECT temperature, humidity, read_at
+FROM readings
+WHERE read_at >= ? AND read_at < ?
+ORDER BY read_at
+LIMIT ?
+'''
+
+SELECT_READINGS_RANGE_AGGREGATED = '''
+SELECT AVG(temperature), AVG(humidity), MIN(read_at)
+FROM readings
+WHERE read_at >= ? AND read_at < ?
+GROUP BY CAST(strftime('%s', read_at) AS INTEGER) / ?
+ORDER BY MIN(read_at)
+LIMIT ?
+'''
+
+
+def reading_to_dict(reading):
+    return {
+        'temperature': reading.temperature,
+        'humidity': reading.humidity,
+        'read_at': reading.read_at.isoformat(),
+    }
+
+
+def etag_matches(header, etag):
+    """Есть ли etag в If-None-Match: списке тегов через запятую или *.
+
+    Сравнение слабое (RFC 9110): префикс W/ не учитывается.
+    """
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.removeprefix('W/').strip('"') == etag:
+            return True
+    return False
+
+
+def json_response(request, data):
+    """JSON-ответ с ETag; при совпадении If-None-Match отдаёт 304."""
+    body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    etag = hashlib.sha1(body).hexdigest()
+    if etag_matches(request.headers.get('If-None-Match', ''), etag):
+        return web.Response(status=304, headers={'ETag': f'"{etag}"'})
+    return web.Response(
+        body=body,
+        content_type='application/json',
+        headers={'ETag': f'"{etag}"'},
+    )
+
+
+class ReadingsApi:
+    """HTTP/JSON и WebSocket доступ к показаниям без обращения к датчикам.
+
+    Последнее показание и рассылку по WebSocket получает из publish(),
+    который вызывает монитор; история читается из таблицы readings.
+    """
+
+    def __init__(self, database_path, host, port):
+        self.database_path = database_path
+        self.host = host
+        self.port = port
+        self.latest = None
+        self._clients = set()
+        self._websockets = set()
+        self._runner = None
+
+        self.app = web.Application()
+        self.app.router.add_get('/readings/latest', self.readings_latest)
+        self.app.router.add_get('/readings', self.readings_range)
+        self.app.router.add_get('/ws', self.websocket)
+        self.app.on_shutdown.append(self._close_websockets)
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info('Readings API listening on %s:%s', self.host, self.port)
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+
+    def publish(self, reading) -> None:
+        self.latest = reading_to_dict(reading)
+        payload = json.dumps(self.latest, ensure_ascii=False)
+        for queue in self._clients:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(payload)
+
+    async def readings_latest(self, request: web.Request) -> web.Response:
+        if self.latest is None:
+            raise web.HTTPNotFound(text='no readings yet')
+        return json_response(request, self.latest)
+
+    async def readings_range(self, request: web.Request) -> web.Response:
+        try:
+            since = datetime.fromisoformat(request.query['since'])
+            until = datetime.fromisoformat(
+                request.query.get('until', datetime.now().isoformat()))
+            bucket = int(request.query.get('bucket', 0))
+        except (KeyError, ValueError):
+            raise web.HTTPBadRequest(
+                text='expected since=<iso>[&until=<iso>][&bucket=<seconds>]')
+
+        rows = await asyncio.to_thread(
+            self._select_range, since, until, bucket)
+        return json_response(request, [
+            {'temperature': temperature, 'humidity': humidity,
+             'read_at': read_at}
+            for temperature, humidity, read_at in rows
+        ])
+
+    def _select_range(self, since, until, bucket):
+        if bucket > 0:
+            query = SELECT_READINGS_RANGE_AGGREGATED
+            parameters = (
+                since.isoformat(), until.isoformat(), bucket, MAX_RANGE_ROWS)
+        else:
+            query = SELECT_READINGS_RANGE
+            parameters = (since.isoformat(), until.isoformat(), MAX_RANGE_ROWS)
+
+        con = sqlite3.connect(
+            f'file:{self.database_path}?mode=ro', uri=True)
+        with con:
+            rows = con.execute(query, parameters).fetchall()
+        con.close()
+        return rows
+
+    async def websocket(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(heartbeat=WS_HEARTBEAT)
+        await ws.prepare(request)
+
+        queue = asyncio.Queue(maxsize=WS_CLIENT_QUEUE_SIZE)
+        if self.latest is not None:
+            queue.put_nowait(json.dumps(self.latest, ensure_ascii=False))
+        self._clients.add(queue)
+        self._websockets.add(ws)
+        sender = asyncio.create_task(self._send_loop(ws, queue))
+        try:
+            async for _ in ws:
+                pass
+        finally:
+            self._clients.discard(queue)
+            self._websockets.discard(ws)
+            sender.cancel()
+        return ws
+
+    async def _send_loop(self, ws, queue) -> None:
+        while True:
+            payload = await queue.get()
+            await ws.send_str(payload)
+
+    async def _close_websockets(self, app) -> None:
+        for ws in tuple(self._websockets):
+            await ws.close(code=WSCloseCode.GOING_AWAY,
+                           message=b'Server shutdown')
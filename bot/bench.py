@@ -0,0 +1,125 @@
+"""Замер холодного старта и памяти проверки правил.
+
+Запуск из каталога bot:
+
+    python bench.py --max-startup 2.5 --max-rss-mb 120
+
+При превышении порогов скрипт завершается с кодом 1.
+"""
+import argparse
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STARTUP_SNIPPET = '''
+import time
+started_at = time.perf_counter()
+import main
+print(time.perf_counter() - started_at)
+'''
+
+RULE_COUNTS = (100, 10_000, 100_000)
+# Правила в замере распределены по стольким различным порогам
+DISTINCT_THRESHOLDS = 50
+
+
+def measure_startup():
+    result = subprocess.run(
+        [sys.executable, '-c', STARTUP_SNIPPET],
+        cwd=BOT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # ru_maxrss в Linux считается в килобайтах
+    rss_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return float(result.stdout), rss_mb
+
+
+def measure_rules(rule_count):
+    from main import (
+        INSERT_NOTIFICATION,
+        Reading,
+        RuleIndex,
+        SensorBot,
+        SensorMonitor,
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = os.path.join(directory, 'bench.db')
+        sensor_bot = SensorBot.__new__(SensorBot)
+        sensor_bot.database_path = database_path
+        sensor_bot.init_db()
+
+        con = sqlite3.connect(database_path)
+        with con:
+            con.executemany(INSERT_NOTIFICATION, (
+                (user_id, 'temperature', 'greater',
+                 float(user_id % DISTINCT_THRESHOLDS),
+                 datetime.now().isoformat(), 0, None)
+                for user_id in range(rule_count)
+            ))
+        con.close()
+
+        tracemalloc.start()
+        rules = RuleIndex(database_path)
+        rules.reload()
+        index_size, _ = tracemalloc.get_traced_memory()
+
+        monitor = SensorMonitor(
+            None, None, database_path, 0, None, rules, None)
+        reading = Reading(
+            temperature=-100.0, humidity=50.0, read_at=datetime.now())
+
+        tracemalloc.reset_peak()
+        started_at = time.perf_counter()
+        for _ in monitor.match_notifications(reading):
+            pass
+        elapsed = time.perf_counter() - started_at
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return (
+        len(rules.groups),
+        index_size / 1024,
+        (peak - index_size) / 1024,
+        elapsed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--max-startup', type=float)
+    parser.add_argument('--max-rss-mb', type=float)
+    args = parser.parse_args()
+
+    startup, rss_mb = measure_startup()
+    print(f'startup: {startup:.3f} s')
+    print(f'startup rss: {rss_mb:.1f} MB')
+
+    sys.path.insert(0, BOT_DIR)
+    for rule_count in RULE_COUNTS:
+        groups, index_kb, peak_kb, elapsed = measure_rules(rule_count)
+        print(
+            f'{rule_count} rules in {groups} groups: '
+            f'index {index_kb:.1f} KB, evaluate peak {peak_kb:.1f} KB, '
+            f'{elapsed * 1000:.2f} ms'
+        )
+
+    failed = (
+        args.max_startup is not None and startup > args.max_startup or
+        args.max_rss_mb is not None and rss_mb > args.max_rss_mb
+    )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import struct
+import zlib
+from collections import OrderedDict
+
+# Диапазон -> (длительность, размер корзины агрегации), секунды
+CHART_RANGES = {
+    '1h': (60 * 60, 60),
+    '24h': (24 * 60 * 60, 15 * 60),
+    '7d': (7 * 24 * 60 * 60, 60 * 60),
+}
+
+CHART_WIDTH = 640
+CHART_HEIGHT = 320
+CHART_PADDING = 20
+CHART_GRID_LINES = 5
+CHART_CACHE_SIZE = 32
+
+BACKGROUND_COLOR = (255, 255, 255)
+GRID_COLOR = (220, 220, 220)
+AXIS_COLOR = (0, 0, 0)
+LINE_COLOR = (33, 102, 172)
+
+
+class ChartCache:
+    """LRU-кэш отрисованных графиков.
+
+    Ключ -- (параметр, диапазон, номер корзины): пока не началась новая
+    корзина, данные графика не меняются. После первой отправки вместо PNG
+    хранится file_id Telegram, и повторный запрос ничего не загружает.
+    """
+
+    def __init__(self, maxsize=CHART_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def get(self, key):
+        if key not in self._items:
+            return None
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def put(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+
+
+def current_bucket(now, chart_range):
+    _, bucket = CHART_RANGES[chart_range]
+    return int(now) // bucket
+
+
+def render_png(values, width=CHART_WIDTH, height=CHART_HEIGHT):
+    """Рисует линейный график значений и возвращает PNG в виде bytes."""
+    pixels = bytearray(BACKGROUND_COLOR * (width * height))
+
+    def plot(x, y, color):
+        if 0 <= x < width and 0 <= y < height:
+            offset = (y * width + x) * 3
+            pixels[offset:offset + 3] = bytes(color)
+
+    def line(x0, y0, x1, y1, color):
+        dx, dy = abs(x1 - x0), -abs(y1 - y0)
+        sx = 1 if x0 < x1 else -1
+        sy = 1 if y0 < y1 else -1
+        error = dx + dy
+        while True:
+            plot(x0, y0, color)
+            plot(x0, y0 + 1, color)
+            if x0 == x1 and y0 == y1:
+                return
+            e2 = 2 * error
+            if e2 >= dy:
+                error += dy
+                x0 += sx
+            if e2 <= dx:
+                error += dx
+                y0 += sy
+
+    left, top = CHART_PADDING, CHART_PADDING
+    right, bottom = width - CHART_PADDING, height - CHART_PADDING
+
+    for i in range(CHART_GRID_LINES + 1):
+        y = top + (bottom - top) * i // CHART_GRID_LINES
+        line(left, y, right, y, GRID_COLOR)
+    line(left, top, left, bottom, AXIS_COLOR)
+    line(left, bottom, right, bottom, AXIS_COLOR)
+
+    if values:
+        low, high = min(values), max(values)
+        span = (high - low) or 1
+        step = (right - left) / max(len(values) - 1, 1)
+        points = [
+            (
+                round(left + i * step),
+                round(bottom - (value - low) / span * (bottom - top)),
+            )
+            for i, value in enumerate(values)
+        ]
+        if len(points) == 1:
+            points.append(points[0])
+        for (x0, y0), (x1, y1) in zip(points, points[1:]):
+            line(x0, y0, x1, y1, LINE_COLOR)
+
+    stride = width * 3
+    raw = b''.join(
+        b'\x00' + pixels[y * stride:(y + 1) * stride]
+        for y in range(height)
+    )
+    return b''.join((
+        b'\x89PNG\r\n\x1a\n',
+        _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                        8, 2, 0, 0, 0)),
+        _png_chunk(b'IDAT', zlib.compress(raw, 9)),
+        _png_chunk(b'IEND', b''),
+    ))
+
+
+def _png_chunk(tag, data):
+    return (
+        struct.pack('>I', len(data)) + tag + data +
+        struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+    )
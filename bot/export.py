@@ -0,0 +1,90 @@
+"""Выгрузка таблиц базы в CSV.
+
+Запуск из каталога bot:
+
+    python export.py readings -o readings.csv
+    python export.py notifications --user-id 123
+"""
+import argparse
+import csv
+import sqlite3
+import sys
+
+from dotenv import dotenv_values
+
+EXPORT_CHUNK_SIZE = 1000
+
+EXPORT_QUERIES = {
+    'readings': '''
+        SELECT id, temperature, humidity, read_at
+        FROM readings ORDER BY id
+    ''',
+    'readings_hourly': '''
+        SELECT datetime(hour * 3600, 'unixepoch') AS hour, temperature,
+               humidity, samples
+        FROM readings_hourly ORDER BY hour
+    ''',
+    'notifications': '''
+        SELECT id, user_id, parameter, condition, value, created_at,
+               urgent, chat_id
+        FROM notifications ORDER BY id
+    ''',
+}
+
+EXPORT_USER_QUERIES = {
+    'notifications': '''
+        SELECT id, user_id, parameter, condition, value, created_at,
+               urgent, chat_id
+        FROM notifications WHERE user_id=? ORDER BY id
+    ''',
+}
+
+
+def export_csv(database_path, table, out, user_id=None):
+    """Пишет таблицу в out порциями по EXPORT_CHUNK_SIZE строк.
+
+    Чтение идёт в одной транзакции на отдельном read-only соединении:
+    выгрузка видит согласованный снимок, а в режиме WAL не мешает записи
+    из монитора датчиков.
+    """
+    if user_id is None:
+        query, parameters = EXPORT_QUERIES[table], ()
+    else:
+        query, parameters = EXPORT_USER_QUERIES[table], (user_id,)
+
+    con = sqlite3.connect(
+        f'file:{database_path}?mode=ro', uri=True, isolation_level=None)
+    try:
+        con.execute('BEGIN')
+        cur = con.execute(query, parameters)
+        writer = csv.writer(out)
+        writer.writerow(column[0] for column in cur.description)
+        while rows := cur.fetchmany(EXPORT_CHUNK_SIZE):
+            writer.writerows(rows)
+        con.execute('COMMIT')
+    finally:
+        con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Выгрузка таблиц в CSV')
+    parser.add_argument('table', choices=EXPORT_QUERIES)
+    parser.add_argument('-o', '--output', help='файл, по умолчанию stdout')
+    parser.add_argument('--database',
+                        default=dotenv_values().get('DATABASE_PATH'))
+    parser.add_argument('--user-id', type=int)
+    args = parser.parse_args()
+
+    if args.user_id is not None and args.table not in EXPORT_USER_QUERIES:
+        parser.error(f'--user-id is not supported for {args.table}')
+
+    if args.output is None:
+        export_csv(args.database, args.table, sys.stdout, args.user_id)
+        return
+
+    with open(args.output, 'w', newline='') as out:
+        export_csv(args.database, args.table, out, args.user_id)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import math
+from collections import deque
+from statistics import median
+
+# Коэффициент перевода MAD в оценку стандартного отклонения
+MAD_SCALE = 1.4826
+
+
+class SensorFilter:
+    """Потоковая очистка показаний одного датчика.
+
+    Значение проходит проверку диапазона, фильтр Хампеля по кольцевому
+    буферу последних window значений (выброс заменяется медианой) и,
+    если задан alpha, экспоненциальное сглаживание. Время последнего
+    принятого значения хранится в updated_at.
+
+    Значение с trusted=True уже подтверждено источником (например,
+    прошивкой после пересечения порога) и принимается как есть, без
+    замены медианой и сглаживания, чтобы не задерживать срабатывание.
+    """
+
+    def __init__(
+        self,
+        low,
+        high,
+        min_deviation,
+        window=5,
+        threshold=3.0,
+        alpha=None,
+        stale_after=None
+    ):
+        self.low = low
+        self.high = high
+        # Нижняя граница допустимого отклонения, чтобы при MAD == 0
+        # (несколько одинаковых значений подряд) не отбрасывать шум
+        self.min_deviation = min_deviation
+        self.threshold = threshold
+        self.alpha = alpha
+        self.stale_after = stale_after
+        self.value = None
+        self.updated_at = None
+        self._window = deque(maxlen=window)
+
+    def update(self, raw, now, trusted=False):
+        if raw is None or math.isnan(raw):
+            return self.value
+        if not self.low <= raw <= self.high:
+            return self.value
+
+        self._window.append(raw)
+        center = median(self._window)
+        mad = median(abs(x - center) for x in self._window)
+        limit = max(self.threshold * MAD_SCALE * mad, self.min_deviation)
+        sample = raw if abs(raw - center) <= limit else center
+
+        if trusted:
+            # Следующие значения сравниваются уже с новым уровнем
+            self._window.clear()
+            self._window.append(raw)
+            self.value = raw
+        elif self.alpha is None or self.value is None:
+            self.value = sample
+        else:
+            self.value = self.alpha * sample + (1 - self.alpha) * self.value
+        self.updated_at = now
+        return self.value
+
+    def is_stale(self, now):
+        if self.updated_at is None:
+            return True
+        if self.stale_after is None:
+            return False
+        return now - self.updated_at > self.stale_after
+
+    def current(self, now):
+        return None if self.is_stale(now) else self.value
@@ -1,28 +1,88 @@
 import asyncio
+import logging
+import os
+import signal
 import sqlite3
-from datetime import datetime
-from dataclasses import dataclass
-from serial import Serial
+import tempfile
+import time
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from dataclasses import dataclass, field, fields
+from serial import SerialException, serial_for_url
 from dotenv import dotenv_values
 
-from aiogram import Bot, Dispatcher
+from aiogram import Bot, Dispatcher, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ChatMemberStatus, ChatType
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.filters import (
     Command,
+    CommandObject,
     StateFilter,
     and_f
 )
 from aiogram.types import (
     Message,
     BotCommand,
+    BufferedInputFile,
     CallbackQuery,
+    ForceReply,
+    FSInputFile,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
 )
 
-from sensors import get_temperature, get_humidity
+from alerts import (
+    CREATE_ALERT_EVENTS_INDEX,
+    CREATE_ALERT_EVENTS_TABLE,
+    Alert,
+    AlertLog,
+    alert_key,
+    alerts_from_json,
+    alerts_to_json,
+)
+from api import ReadingsApi
+from charts import CHART_RANGES, ChartCache, current_bucket, render_png
+from export import export_csv
+from mqtt_bridge import MqttBridge
+from outbox import (
+    CREATE_DEFERRED_ALERTS_INDEX,
+    CREATE_DEFERRED_ALERTS_TABLE,
+    CREATE_OUTBOX_INDEX,
+    CREATE_OUTBOX_TABLE,
+    Outbox,
+)
+from profiling import LoopLagMonitor, SamplingProfiler
+from ratelimit import RateLimitMiddleware
+from retention import (
+    CREATE_READINGS_HOURLY_TABLE,
+    Retention,
+    enable_incremental_vacuum,
+)
+from preferences import CREATE_PREFERENCES_TABLE, PreferencesStore
+from scheduler import AdaptiveInterval
+from sensors import (
+    get_humidity,
+    get_read_time,
+    get_temperature,
+    send_command,
+    set_sample_interval,
+    start_reader,
+    threshold_table_commands,
+)
+
+logger = logging.getLogger(__name__)
 
 START_MESSAGE = '''Привет. Данный бот позволяет просматривать значения
 температуры и влажности с датчиков в режиме реального времени'''
@@ -34,14 +94,70 @@ CREATE TABLE IF NOT EXISTS notifications (
     parameter TEXT,
     condition TEXT,
     value REAL,
-    created_at TIMESTAMP
+    created_at TIMESTAMP,
+    urgent INTEGER DEFAULT 0,
+    chat_id INTEGER
+)
+'''
+
+ADD_NOTIFICATIONS_URGENT_COLUMN = '''
+ALTER TABLE notifications ADD COLUMN urgent INTEGER DEFAULT 0
+'''
+
+# Группа или канал, куда отправляется уведомление; NULL -- личный чат
+# с user_id
+ADD_NOTIFICATIONS_CHAT_ID_COLUMN = '''
+ALTER TABLE notifications ADD COLUMN chat_id INTEGER
+'''
+
+CREATE_READINGS_TABLE = '''
+CREATE TABLE IF NOT EXISTS readings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    temperature REAL,
+    humidity REAL,
+    read_at TIMESTAMP
 )
 '''
 
+CREATE_READINGS_INDEX = '''
+CREATE INDEX IF NOT EXISTS readings_read_at ON readings (read_at)
+'''
+
+INSERT_READING = '''
+INSERT INTO readings (temperature, humidity, read_at) VALUES (?, ?, ?)
+'''
+
+SELECT_READINGS_AGGREGATED = '''
+SELECT
+    CAST(strftime('%s', read_at) AS INTEGER) / :bucket AS bucket,
+    AVG(temperature),
+    AVG(humidity)
+FROM readings
+WHERE read_at >= :since
+GROUP BY bucket
+ORDER BY bucket
+'''
+
+CREATE_NOTIFICATIONS_USER_ID_INDEX = '''
+CREATE INDEX IF NOT EXISTS notifications_user_id ON notifications (user_id)
+'''
+
+CREATE_NOTIFICATIONS_CHAT_ID_INDEX = '''
+CREATE INDEX IF NOT EXISTS notifications_chat_id ON notifications (chat_id)
+'''
+
+COUNT_USER_NOTIFICATIONS = '''
+SELECT COUNT(*) FROM notifications WHERE user_id=?
+'''
+
 SELECT_USER_NOTIFICATIONS = '''
 SELECT * FROM notifications WHERE user_id=?
 '''
 
+SELECT_CHAT_NOTIFICATIONS = '''
+SELECT * FROM notifications WHERE chat_id=?
+'''
+
 SELECT_NOTIFICATIONS = '''
 SELECT * FROM notifications
 '''
@@ -52,18 +168,20 @@ INSERT INTO notifications (
     parameter,
     condition,
     value,
-    created_at
-) VALUES (?, ?, ?, ?, ?)
-'''
-
-SELECT_USER_NOTIFICATION_BY_ID = '''
-SELECT 1 FROM notifications WHERE id=? AND user_id=?
+    created_at,
+    urgent,
+    chat_id
+) VALUES (?, ?, ?, ?, ?, ?, ?)
 '''
 
 DELETE_NOTIFICATION = '''
 DELETE FROM notifications WHERE user_id=? AND id=?
 '''
 
+DELETE_CHAT_NOTIFICATION = '''
+DELETE FROM notifications WHERE chat_id=? AND id=?
+'''
+
 TEMPERATURE_CALLBACK_DATA = 'temperature'
 HUMIDITY_CALLBACK_DATA = 'humidity'
 
@@ -71,6 +189,58 @@ LESS_CONDITION_CALLBACK_DATA = 'less'
 EQUAL_CONDITION_CALLBACK_DATA = 'equal'
 GREATER_CONDITION_CALLBACK_DATA = 'greater'
 
+URGENT_CALLBACK_DATA = 'urgent'
+NORMAL_CALLBACK_DATA = 'normal'
+
+# Условие "равна" выполняется с этой точностью; то же значение
+# использует прошивка (equalTolerance), чтобы её кадры и проверка ботом
+# не расходились
+EQUAL_TOLERANCE = 0.01
+
+# Очереди между этапами мониторинга ограничены: если отправка уведомлений
+# не успевает, проверка правил и чтение датчиков ждут (backpressure)
+READINGS_QUEUE_SIZE = 1
+ALERTS_QUEUE_SIZE = 100
+
+SUPERVISOR_MIN_BACKOFF = 1
+SUPERVISOR_MAX_BACKOFF = 60
+SHUTDOWN_DRAIN_TIMEOUT = 10
+
+# Пауза между командами загрузки порогов: приёмный буфер Nano -- 64 байта
+FIRMWARE_COMMAND_DELAY = 0.1
+# Nano перезагружается при открытии порта, загрузчику нужно время
+FIRMWARE_BOOT_DELAY = 2
+
+# Как часто проверять, не пора ли отправить накопленные сводки, секунды
+DIGEST_CHECK_INTERVAL = 60
+
+# Лимиты по умолчанию: запросов в секунду, запас запросов, правил
+DEFAULT_RATE_LIMIT = 0.5
+DEFAULT_RATE_BURST = 10
+DEFAULT_MAX_RULES = 20
+
+# Как часто записывать накопленные события журнала уведомлений, секунды
+ALERT_LOG_FLUSH_INTERVAL = 10
+
+ALERTS_HISTORY_LIMIT = 10
+
+# Исходящие сообщения: не быстрее лимита Telegram на массовую рассылку
+OUTBOX_RATE = 25
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_IDLE_INTERVAL = 60
+
+# Правила читаются порциями при построении индекса
+FETCH_BATCH_SIZE = 256
+
+# Сроки хранения по умолчанию, дни; 0 -- хранить всё
+DEFAULT_READINGS_RETENTION = 30
+DEFAULT_ALERT_EVENTS_RETENTION = 90
+
+# Блокировка event loop дольше этого срока попадает в лог, миллисекунды
+DEFAULT_LOOP_LAG_THRESHOLD = 100
+# Длительность профилирования по /debug и SIGUSR1, секунды
+DEBUG_PROFILE_DURATION = 10
+
 PARAMETERS_MARKUP = InlineKeyboardMarkup(
     inline_keyboard=[
         [InlineKeyboardButton(text='Температура',
@@ -79,6 +249,32 @@ PARAMETERS_MARKUP = InlineKeyboardMarkup(
     ]
 )
 
+CHART_CALLBACK_PREFIX = 'chart:'
+
+CHART_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text=f'Температура {label}',
+                                 callback_data=f'chart:temperature:{key}')
+            for key, label in (('1h', '1ч'), ('24h', '24ч'), ('7d', '7д'))
+        ],
+        [
+            InlineKeyboardButton(text=f'Влажность {label}',
+                                 callback_data=f'chart:humidity:{key}')
+            for key, label in (('1h', '1ч'), ('24h', '24ч'), ('7d', '7д'))
+        ],
+    ]
+)
+
+URGENCY_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text='Да', callback_data='urgent'),
+            InlineKeyboardButton(text='Нет', callback_data='normal')
+        ]
+    ]
+)
+
 CONDITIONS_MARKUP = InlineKeyboardMarkup(
     inline_keyboard=[
         [
@@ -91,7 +287,7 @@ CONDITIONS_MARKUP = InlineKeyboardMarkup(
 )
 
 
-@dataclass
+@dataclass(slots=True)
 class Notification:
     id: object
     user_id: object
@@ -99,13 +295,29 @@ class Notification:
     condition: object
     value: object
     created_at: object
+    urgent: object
+    chat_id: object = None
+
+    @property
+    def recipient(self):
+        """Чат, в который отправляется уведомление."""
+        return self.chat_id if self.chat_id is not None else self.user_id
 
     def __str__(self):
-        return (
+        text = (
             Notification.parameter_to_str(self.parameter) + ' ' +
             Notification.condition_to_str(self.condition) + ' ' +
             str(self.value)
         ).capitalize()
+        if self.urgent:
+            text += ' (срочное)'
+        return text
+
+    def is_valid(self):
+        return (
+            Notification.parameter_to_str(self.parameter) is not None
+            and Notification.condition_to_str(self.condition) is not None
+        )
 
     @staticmethod
     def parameter_to_str(parameter):
@@ -124,11 +336,148 @@ class Notification:
         }
         return conditions.get(condition)
 
+    def is_triggered(self, current):
+        if current is None:
+            return False
+
+        match self.condition:
+            case 'less':
+                return current < self.value
+            case 'greater':
+                return current > self.value
+            case 'equal':
+                return abs(current - self.value) < EQUAL_TOLERANCE
+        return False
+
+
+@dataclass(slots=True)
+class Reading:
+    temperature: float | None
+    humidity: float | None
+    read_at: datetime
+
+    def get(self, parameter):
+        match parameter:
+            case 'temperature':
+                return self.temperature
+            case 'humidity':
+                return self.humidity
+        return None
+
+
+@dataclass(slots=True)
+class RuleGroup:
+    # Одно из правил группы: все правила группы имеют одинаковые
+    # parameter, condition и value
+    rule: Notification
+    # urgent -> готовый текст уведомления
+    messages: dict
+    # Подписчики по одному на чат в параллельных массивах: кортеж на
+    # каждое правило занимал бы в несколько раз больше памяти
+    rule_ids: array = field(default_factory=lambda: array('q'))
+    recipients: array = field(default_factory=lambda: array('q'))
+    urgent: bytearray = field(default_factory=bytearray)
+
+    def add_subscriber(self, rule_id, recipient, urgent):
+        self.rule_ids.append(rule_id)
+        self.recipients.append(recipient)
+        self.urgent.append(urgent)
+
+    def subscribers(self):
+        """Тройки (notification_id, recipient, urgent)."""
+        return zip(self.rule_ids, self.recipients, map(bool, self.urgent))
+
+
+class RuleIndex:
+    """Правила, сгруппированные по (parameter, condition, value).
+
+    Каждая группа проверяется один раз на показание, а её текст
+    используется для всех подписчиков. reload() строит новый словарь
+    групп и подменяет его целиком, поэтому проверка никогда не видит
+    частично построенный индекс. refresh() делает то же, но строит
+    индекс в отдельном потоке, не блокируя event loop.
+    """
+
+    def __init__(self, database_path):
+        self.database_path = database_path
+        self.groups = {}
+        # parameter -> отсортированные пороги всех правил
+        self.thresholds = {}
+        # Вызываются после каждой перестройки индекса
+        self.on_reload = []
+        # Перестройки идут по очереди: индекс, построенный раньше, не
+        # должен подменить построенный позже
+        self._refresh_lock = asyncio.Lock()
+
+    def reload(self):
+        self._swap(*self.build())
+
+    async def refresh(self):
+        async with self._refresh_lock:
+            index = await asyncio.to_thread(self.build)
+            self._swap(*index)
+
+    def build(self):
+        groups = {}
+        recipients = {}
+        con = sqlite3.connect(self.database_path)
+        with con:
+            cur = con.execute(SELECT_NOTIFICATIONS)
+            while rows := cur.fetchmany(FETCH_BATCH_SIZE):
+                for row in rows:
+                    notification = Notification(*row)
+                    if not notification.is_valid():
+                        logger.warning('Skipping invalid rule %s: %s %s',
+                                       notification.id,
+                                       notification.parameter,
+                                       notification.condition)
+                        continue
+                    key = (
+                        notification.parameter,
+                        notification.condition,
+                        notification.value,
+                    )
+                    group = groups.get(key)
+                    if group is None:
+                        group = groups[key] = RuleGroup(notification, {})
+
+                    urgent = bool(notification.urgent)
+                    group.messages.setdefault(
+                        urgent, f'Сработало уведомление {notification}')
+                    # Одинаковые правила нескольких администраторов
+                    # группы дают одно сообщение в группу
+                    subscriber = (notification.recipient, urgent)
+                    if subscriber not in recipients.setdefault(key, set()):
+                        recipients[key].add(subscriber)
+                        group.add_subscriber(notification.id, *subscriber)
+        con.close()
+
+        thresholds = {}
+        for parameter, _, value in groups:
+            thresholds.setdefault(parameter, set()).add(value)
+        return groups, {
+            parameter: tuple(sorted(values))
+            for parameter, values in thresholds.items()
+        }
+
+    def _swap(self, groups, thresholds):
+        self.groups = groups
+        self.thresholds = thresholds
+        for callback in self.on_reload:
+            callback()
+
+    def match(self, reading):
+        for group in self.groups.values():
+            current = reading.get(group.rule.parameter)
+            if group.rule.is_triggered(current):
+                yield group
+
 
 class SetNotificationStates(StatesGroup):
     waiting_parameter = State()
     waiting_condition = State()
     waiting_value = State()
+    waiting_urgency = State()
 
 
 class DeleteNotificationStates(StatesGroup):
@@ -138,31 +487,100 @@ class DeleteNotificationStates(StatesGroup):
 @dataclass
 class Config:
     token: str
+    api_url: str | None
     port: int
     database_path: str
     check_interval: int
+    min_check_interval: int
+    api_host: str
+    api_port: int | None
+    mqtt_host: str | None
+    mqtt_port: int
+    mqtt_sensor_id: str
+    mqtt_username: str | None
+    mqtt_password: str | None
+    rate_limit: float
+    rate_burst: int
+    max_rules: int
+    admin_ids: frozenset[int]
+    loop_lag_threshold: int
+    readings_retention: int
+    alert_events_retention: int
 
     @classmethod
     def from_env(cls):
         variables = dotenv_values()
+        api_port = variables.get('API_PORT')
         return cls(
             token=variables.get('TOKEN'),
+            api_url=variables.get('TELEGRAM_API_URL'),
             port=variables.get('PORT'),
             database_path=variables.get('DATABASE_PATH'),
-            check_interval=variables.get('CHECK_INTERVAL'),
+            check_interval=int(variables.get('CHECK_INTERVAL')),
+            min_check_interval=int(
+                variables.get('MIN_CHECK_INTERVAL',
+                              variables.get('CHECK_INTERVAL'))),
+            api_host=variables.get('API_HOST', '127.0.0.1'),
+            api_port=int(api_port) if api_port else None,
+            mqtt_host=variables.get('MQTT_HOST'),
+            mqtt_port=int(variables.get('MQTT_PORT', 1883)),
+            mqtt_sensor_id=variables.get('MQTT_SENSOR_ID', 'nano'),
+            mqtt_username=variables.get('MQTT_USERNAME'),
+            mqtt_password=variables.get('MQTT_PASSWORD'),
+            rate_limit=float(
+                variables.get('RATE_LIMIT', DEFAULT_RATE_LIMIT)),
+            rate_burst=int(variables.get('RATE_BURST', DEFAULT_RATE_BURST)),
+            max_rules=int(variables.get('MAX_RULES', DEFAULT_MAX_RULES)),
+            admin_ids=frozenset(
+                int(user_id)
+                for user_id in variables.get('ADMIN_IDS', '').split(',')
+                if user_id.strip()
+            ),
+            loop_lag_threshold=int(variables.get(
+                'LOOP_LAG_THRESHOLD', DEFAULT_LOOP_LAG_THRESHOLD)),
+            readings_retention=int(variables.get(
+                'READINGS_RETENTION_DAYS', DEFAULT_READINGS_RETENTION)),
+            alert_events_retention=int(variables.get(
+                'ALERT_EVENTS_RETENTION_DAYS',
+                DEFAULT_ALERT_EVENTS_RETENTION)),
         )
 
 
 class SensorBot:
-    def __init__(self, token, ser, database_path):
-        self.bot = Bot(token=token)
+    def __init__(
+        self,
+        token,
+        ser,
+        database_path,
+        rate_limit=DEFAULT_RATE_LIMIT,
+        rate_burst=DEFAULT_RATE_BURST,
+        max_rules=DEFAULT_MAX_RULES,
+        api_url=None,
+        admin_ids=frozenset(),
+        loop_lag_threshold=DEFAULT_LOOP_LAG_THRESHOLD
+    ):
+        self.bot = create_bot(token, api_url)
         self.ser = ser
         self.database_path = database_path
+        self.max_rules = max_rules
+        self.admin_ids = admin_ids
         self.storage = MemoryStorage()
         self.dp = Dispatcher(storage=self.storage)
+        self.rate_limiter = RateLimitMiddleware(rate_limit, rate_burst)
+        self.chart_cache = ChartCache()
+        self.preferences = PreferencesStore(database_path)
+        self.rules = RuleIndex(database_path)
+        self.alert_log = AlertLog(database_path)
+        self.profiler = SamplingProfiler()
+        self.lag_monitor = LoopLagMonitor(loop_lag_threshold / 1000)
+        # ConfigReloader, назначается в main()
+        self.reloader = None
+        self._restart_polling = False
 
         self._setup_commands()
         self.init_db()
+        self.preferences.load()
+        self.rules.reload()
         self.register_handlers()
 
     def _setup_commands(self):
@@ -171,23 +589,68 @@ class SensorBot:
             BotCommand(command='temperature',
                        description='текущая температура'),
             BotCommand(command='humidity', description='текущая влажность'),
+            BotCommand(command='chart',
+                       description='график за период'),
+            BotCommand(command='export',
+                       description='выгрузить данные в CSV'),
             BotCommand(command='notifications',
                        description='активные уведомления'),
             BotCommand(command='setnotification',
                        description='установить уведомление'),
             BotCommand(command='deletenotification',
                        description='удалить уведомление'),
+            BotCommand(command='alerts',
+                       description='история сработавших уведомлений'),
+            BotCommand(command='settings',
+                       description='настройки доставки уведомлений'),
+            BotCommand(command='quiethours',
+                       description='тихие часы, например 23-7 или off'),
+            BotCommand(command='timezone',
+                       description='часовой пояс, например Europe/Moscow'),
+            BotCommand(command='digest',
+                       description='интервал сводки в минутах, 0 - выкл'),
             BotCommand(command='cancel',
                        description='отменить операцию'),
         ]
 
     def init_db(self):
         con = sqlite3.connect(self.database_path)
+        enable_incremental_vacuum(con)
+        # WAL позволяет читать снимок базы (например, при выгрузке),
+        # не блокируя запись показаний
+        con.execute('PRAGMA journal_mode=WAL')
         with con:
             con.execute(CREATE_NOTIFICATIONS_TABLE)
+            con.execute(CREATE_READINGS_TABLE)
+            con.execute(CREATE_READINGS_INDEX)
+            con.execute(CREATE_READINGS_HOURLY_TABLE)
+            con.execute(CREATE_NOTIFICATIONS_USER_ID_INDEX)
+            con.execute(CREATE_PREFERENCES_TABLE)
+            con.execute(CREATE_ALERT_EVENTS_TABLE)
+            con.execute(CREATE_ALERT_EVENTS_INDEX)
+            con.execute(CREATE_OUTBOX_TABLE)
+            con.execute(CREATE_OUTBOX_INDEX)
+            con.execute(CREATE_DEFERRED_ALERTS_TABLE)
+            con.execute(CREATE_DEFERRED_ALERTS_INDEX)
+
+            columns = {
+                row[1] for row in
+                con.execute('PRAGMA table_info(notifications)')
+            }
+            if 'urgent' not in columns:
+                con.execute(ADD_NOTIFICATIONS_URGENT_COLUMN)
+            if 'chat_id' not in columns:
+                con.execute(ADD_NOTIFICATIONS_CHAT_ID_COLUMN)
+            con.execute(CREATE_NOTIFICATIONS_CHAT_ID_INDEX)
         con.close()
 
     def register_handlers(self):
+        # Внутренний middleware вызывается только для событий, которые
+        # дошли до обработчика: обычная переписка в группе не расходует
+        # запас запросов
+        self.dp.message.middleware(self.rate_limiter)
+        self.dp.callback_query.middleware(self.rate_limiter)
+
         self.dp.message(
             and_f(StateFilter(None), Command('start'))
         )(self.start)
@@ -202,6 +665,18 @@ class SensorBot:
             and_f(StateFilter(None), Command('humidity'))
         )(self.humidity)
 
+        self.dp.message(
+            and_f(StateFilter(None), Command('chart'))
+        )(self.chart)
+
+        self.dp.callback_query(
+            F.data.startswith(CHART_CALLBACK_PREFIX)
+        )(self.process_chart)
+
+        self.dp.message(
+            and_f(StateFilter(None), Command('export'))
+        )(self.export)
+
         self.dp.message(
             and_f(StateFilter(None), Command('notifications'))
         )(self.notifications)
@@ -222,6 +697,38 @@ class SensorBot:
             SetNotificationStates.waiting_value
         )(self.process_value)
 
+        self.dp.callback_query(
+            SetNotificationStates.waiting_urgency
+        )(self.process_urgency)
+
+        self.dp.message(
+            and_f(StateFilter(None), Command('alerts'))
+        )(self.alerts)
+
+        self.dp.message(
+            and_f(StateFilter(None), Command('settings'))
+        )(self.settings)
+
+        self.dp.message(
+            and_f(StateFilter(None), Command('quiethours'))
+        )(self.quiethours)
+
+        self.dp.message(
+            and_f(StateFilter(None), Command('timezone'))
+        )(self.timezone)
+
+        self.dp.message(
+            and_f(StateFilter(None), Command('digest'))
+        )(self.digest)
+
+        self.dp.message(
+            and_f(StateFilter(None), Command('debug'))
+        )(self.debug)
+
+        self.dp.message(
+            and_f(StateFilter(None), Command('reload'))
+        )(self.reload)
+
         self.dp.message(
             and_f(StateFilter(None), Command('deletenotification'))
         )(self.deletenotification)
@@ -231,8 +738,26 @@ class SensorBot:
         )(self.process_delete_index)
 
     async def start_polling(self):
-        await self.bot.set_my_commands(self.commands)
-        await self.dp.start_polling(self.bot)
+        while True:
+            self._restart_polling = False
+            await self.bot.set_my_commands(self.commands)
+            await self.dp.start_polling(self.bot)
+            if not self._restart_polling:
+                return
+
+    async def replace_bot(self, bot) -> None:
+        """Продолжает опрос с новым токеном без перезапуска процесса.
+
+        Диспетчер и MemoryStorage остаются прежними, поэтому начатые
+        диалоги сохраняются, если токен принадлежит тому же боту. Сессию
+        старого Bot закрывает сам диспетчер при остановке опроса.
+        Кэш графиков сбрасывается: file_id действительны только для бота,
+        который их получил.
+        """
+        self.bot = bot
+        self.chart_cache.clear()
+        self._restart_polling = True
+        await self.dp.stop_polling()
 
     async def start(
         self,
@@ -269,20 +794,112 @@ class SensorBot:
         humidity = get_humidity(self.ser)
         await message.answer(f'Текущее значение влажности: {humidity}')
 
-    async def notifications(
+    async def chart(
         self,
         message: Message,
         state: FSMContext
     ) -> None:
+        await message.answer(
+            'Выберите параметр и период:',
+            reply_markup=CHART_MARKUP
+        )
+
+    async def process_chart(
+        self,
+        callback: CallbackQuery,
+        state: FSMContext
+    ) -> None:
+        # callback_data приходит от клиента и может быть любой строкой
+        parameter, _, chart_range = callback.data.removeprefix(
+            CHART_CALLBACK_PREFIX).partition(':')
+        if (
+            parameter not in (TEMPERATURE_CALLBACK_DATA,
+                              HUMIDITY_CALLBACK_DATA)
+            or chart_range not in CHART_RANGES
+        ):
+            await callback.answer('Выберите график')
+            return
+
+        bucket = current_bucket(time.time(), chart_range)
+        key = (parameter, chart_range, bucket)
+
+        cached = self.chart_cache.get(key)
+        if cached is not None:
+            file_id, caption = cached
+            await callback.message.answer_photo(file_id, caption=caption)
+            await callback.answer()
+            return
+
+        values = await asyncio.to_thread(
+            self.load_chart_values, parameter, chart_range)
+        if not values:
+            await callback.message.answer('Нет данных за выбранный период')
+            await callback.answer()
+            return
+
+        png = await asyncio.to_thread(render_png, values)
+        caption = (
+            f'{Notification.parameter_to_str(parameter).capitalize()} '
+            f'за {chart_range}: мин {min(values):.1f}, '
+            f'макс {max(values):.1f}, '
+            f'среднее {sum(values) / len(values):.1f}'
+        )
+        sent = await callback.message.answer_photo(
+            BufferedInputFile(png, filename='chart.png'),
+            caption=caption
+        )
+        # Ответ старым ботом, пришедший после replace_bot, в кэш не попадает
+        if callback.bot is self.bot:
+            self.chart_cache.put(key, (sent.photo[-1].file_id, caption))
+        await callback.answer()
+
+    def load_chart_values(self, parameter, chart_range):
+        duration, bucket = CHART_RANGES[chart_range]
+        since = datetime.now() - timedelta(seconds=duration)
+        column = {
+            TEMPERATURE_CALLBACK_DATA: 1,
+            HUMIDITY_CALLBACK_DATA: 2,
+        }[parameter]
+
         con = sqlite3.connect(self.database_path)
         with con:
             cur = con.execute(
-                SELECT_USER_NOTIFICATIONS,
-                (message.from_user.id,)
+                SELECT_READINGS_AGGREGATED,
+                {'bucket': bucket, 'since': since.isoformat()}
             )
-            notifications = tuple(
-                Notification(*row) for row in cur.fetchall())
+            values = [
+                row[column] for row in cur
+                if row[column] is not None
+            ]
         con.close()
+        return values
+
+    async def export(
+        self,
+        message: Message,
+        state: FSMContext
+    ) -> None:
+        tables = (
+            ('readings', None),
+            ('notifications', message.from_user.id),
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            for table, user_id in tables:
+                path = os.path.join(directory, f'{table}.csv')
+                await asyncio.to_thread(
+                    self.export_to_file, table, path, user_id)
+                await message.answer_document(FSInputFile(path))
+
+    def export_to_file(self, table, path, user_id):
+        with open(path, 'w', newline='') as out:
+            export_csv(self.database_path, table, out, user_id)
+
+    async def notifications(
+        self,
+        message: Message,
+        state: FSMContext
+    ) -> None:
+        notifications = self.chat_notifications(message)
 
         if not notifications:
             await message.answer('У вас нет активных уведомлений')
@@ -291,15 +908,85 @@ class SensorBot:
         response_lst = ['Ваши активные уведомления:']
 
         for idx, notification in enumerate(notifications, start=1):
-            response_lst.append(f'({idx}) {notification}')
+            line = f'({idx}) {notification}'
+            if message.chat.type == ChatType.PRIVATE and notification.chat_id:
+                line += f' - в чат {notification.chat_id}'
+            response_lst.append(line)
 
         await message.answer('\n'.join(response_lst))
 
+    def chat_notifications(self, message):
+        """Правила пользователя в личном чате, правила группы в группе."""
+        if message.chat.type == ChatType.PRIVATE:
+            query, chat_id = SELECT_USER_NOTIFICATIONS, message.from_user.id
+        else:
+            query, chat_id = SELECT_CHAT_NOTIFICATIONS, message.chat.id
+
+        con = sqlite3.connect(self.database_path)
+        with con:
+            cur = con.execute(query, (chat_id,))
+            notifications = [Notification(*row) for row in cur.fetchall()]
+        con.close()
+        return notifications
+
+    async def is_chat_admin(self, chat_id, user_id) -> bool:
+        try:
+            member = await self.bot.get_chat_member(chat_id, user_id)
+        except TelegramAPIError:
+            return False
+        return member.status in (
+            ChatMemberStatus.CREATOR,
+            ChatMemberStatus.ADMINISTRATOR,
+        )
+
+    async def notification_chat(self, message, args):
+        """Группа или канал, для которых устанавливается уведомление.
+
+        В группе -- сама группа, в личном чате -- чат из аргумента команды
+        (@username или id), например канал. Возвращает None для личного
+        уведомления и False, если чат недоступен или пользователь не его
+        администратор.
+        """
+        if message.chat.type != ChatType.PRIVATE:
+            chat_id = message.chat.id
+        elif args:
+            args = args.strip()
+            try:
+                chat = await self.bot.get_chat(
+                    int(args) if args.lstrip('-').isdigit() else args)
+            except TelegramAPIError:
+                await message.answer(
+                    'Чат не найден, сначала добавьте в него бота')
+                return False
+            chat_id = chat.id
+        else:
+            return None
+
+        if not await self.is_chat_admin(chat_id, message.from_user.id):
+            await message.answer(
+                'Уведомления для чата могут настраивать только '
+                'его администраторы')
+            return False
+        return chat_id
+
     async def setnotification(
         self,
         message: Message,
-        state: FSMContext
+        state: FSMContext,
+        command: CommandObject
     ) -> None:
+        chat_id = await self.notification_chat(message, command.args)
+        if chat_id is False:
+            return
+
+        if self.count_notifications(message.from_user.id) >= self.max_rules:
+            await message.answer(
+                f'Нельзя установить больше {self.max_rules} уведомлений, '
+                'удалите ненужные через /deletenotification')
+            return
+
+        await state.update_data(chat_id=chat_id)
+
         await message.answer(
             'Выберите параметр для уведомления:',
             reply_markup=PARAMETERS_MARKUP
@@ -311,6 +998,11 @@ class SensorBot:
         callback: CallbackQuery,
         state: FSMContext
     ) -> None:
+        # Кнопка из старого сообщения может прийти в другом состоянии
+        if Notification.parameter_to_str(callback.data) is None:
+            await callback.answer('Выберите параметр')
+            return
+
         await state.update_data(parameter=callback.data)
         await callback.message.edit_text(
             'Выберите условие:',
@@ -333,11 +1025,24 @@ class SensorBot:
             await callback.answer()
             return
 
+        if Notification.condition_to_str(callback.data) is None:
+            await callback.answer('Выберите условие')
+            return
+
         await state.update_data(condition=callback.data)
-        await callback.message.edit_text(
-            'Введите числовое значение:',
-            reply_markup=None
-        )
+        if callback.message.chat.type == ChatType.PRIVATE:
+            await callback.message.edit_text(
+                'Введите числовое значение:',
+                reply_markup=None
+            )
+        else:
+            # Без прав администратора бот видит в группе только команды
+            # и ответы на свои сообщения
+            await callback.message.delete()
+            await callback.message.answer(
+                'Введите числовое значение ответом на это сообщение:',
+                reply_markup=ForceReply()
+            )
         await state.set_state(SetNotificationStates.waiting_value)
         await callback.answer()
 
@@ -348,51 +1053,338 @@ class SensorBot:
     ) -> None:
         try:
             value = float(message.text)
-            data = await state.get_data()
+        except ValueError:
+            await message.answer('Пожалуйста, введите корректное число')
+            return
 
-            parameters = (
-                message.from_user.id,
+        await state.update_data(value=value)
+        await message.answer(
+            'Срочное уведомление? Срочные приходят сразу, даже в тихие часы',
+            reply_markup=URGENCY_MARKUP
+        )
+        await state.set_state(SetNotificationStates.waiting_urgency)
+
+    async def process_urgency(
+        self,
+        callback: CallbackQuery,
+        state: FSMContext
+    ) -> None:
+        if callback.data not in (URGENT_CALLBACK_DATA, NORMAL_CALLBACK_DATA):
+            await callback.answer('Выберите срочность')
+            return
+
+        data = await state.get_data()
+        await state.clear()
+        try:
+            await self.add_notification(
+                callback.from_user.id,
                 data['parameter'],
                 data['condition'],
-                value,
-                datetime.now().isoformat(),
+                data['value'],
+                callback.data == URGENT_CALLBACK_DATA,
+                data.get('chat_id'),
+            )
+        except ValueError:
+            await callback.message.edit_text(
+                f'Нельзя установить больше {self.max_rules} уведомлений',
+                reply_markup=None
             )
+            await callback.answer()
+            return
 
-            con = sqlite3.connect(self.database_path)
-            with con:
-                con.execute(
-                    INSERT_NOTIFICATION,
-                    parameters
-                )
-            con.close()
+        await callback.message.edit_text(
+            'Уведомление успешно установлено!',
+            reply_markup=None
+        )
+        await callback.answer()
 
-            await message.answer('Уведомление успешно установлено!')
-            await state.clear()
+    def count_notifications(self, user_id):
+        con = sqlite3.connect(self.database_path)
+        with con:
+            count, = con.execute(
+                COUNT_USER_NOTIFICATIONS, (user_id,)).fetchone()
+        con.close()
+        return count
+
+    async def add_notification(
+        self,
+        user_id,
+        parameter,
+        condition,
+        value,
+        urgent,
+        chat_id=None
+    ):
+        if self.count_notifications(user_id) >= self.max_rules:
+            raise ValueError('rule limit reached')
+
+        parameters = (
+            user_id,
+            parameter,
+            condition,
+            value,
+            datetime.now().isoformat(),
+            int(urgent),
+            chat_id,
+        )
+
+        con = sqlite3.connect(self.database_path)
+        with con:
+            con.execute(
+                INSERT_NOTIFICATION,
+                parameters
+            )
+        con.close()
+        await self.rules.refresh()
+
+    async def delete_notification(
+        self,
+        user_id,
+        notification_id,
+        chat_id=None
+    ):
+        """Удаляет правило пользователя, а с chat_id -- правило группы,
+        кто бы из администраторов его ни установил."""
+        if chat_id is None:
+            query, owner = DELETE_NOTIFICATION, user_id
+        else:
+            query, owner = DELETE_CHAT_NOTIFICATION, chat_id
+
+        con = sqlite3.connect(self.database_path)
+        with con:
+            cur = con.execute(query, (owner, notification_id))
+        con.close()
+        await self.rules.refresh()
+        return cur.rowcount > 0
+
+    async def alerts(
+        self,
+        message: Message,
+        state: FSMContext
+    ) -> None:
+        # В личном чате chat.id совпадает с id пользователя, в группе
+        # показываются уведомления, отправленные в группу
+        events = self.alert_log.recent(
+            message.chat.id, ALERTS_HISTORY_LIMIT)
+        if not events:
+            await message.answer('Уведомления ещё не срабатывали')
+            return
 
+        response_lst = ['Последние сработавшие уведомления:']
+        for text, read_at, sent_at, result, retries in events:
+            read_at = datetime.fromisoformat(read_at)
+            line = f'{read_at:%d.%m %H:%M:%S} {text}'
+            if result == 'ok':
+                latency = datetime.fromisoformat(sent_at) - read_at
+                line += f' - доставлено за {latency.total_seconds():.1f} с'
+            else:
+                line += f' - не доставлено ({result})'
+            if retries:
+                line += f', повторов: {retries}'
+            response_lst.append(line)
+
+        await message.answer('\n'.join(response_lst))
+
+    async def settings(
+        self,
+        message: Message,
+        state: FSMContext
+    ) -> None:
+        preferences = self.preferences.get(message.from_user.id)
+
+        if preferences.quiet_start is None:
+            quiet_hours = 'не заданы'
+        else:
+            quiet_hours = (
+                f'{preferences.quiet_start}-{preferences.quiet_end}')
+        timezone = preferences.timezone or 'время сервера'
+        if preferences.digest_interval:
+            digest = f'раз в {preferences.digest_interval} мин'
+        else:
+            digest = 'выключена'
+
+        await message.answer('\n'.join((
+            f'Тихие часы: {quiet_hours} (/quiethours)',
+            f'Часовой пояс: {timezone} (/timezone)',
+            f'Сводка несрочных уведомлений: {digest} (/digest)',
+        )))
+
+    async def quiethours(
+        self,
+        message: Message,
+        state: FSMContext,
+        command: CommandObject
+    ) -> None:
+        preferences = self.preferences.get(message.from_user.id)
+        args = (command.args or '').strip()
+
+        if args == 'off':
+            preferences.quiet_start = preferences.quiet_end = None
+        else:
+            try:
+                start, end = (int(hour) for hour in args.split('-'))
+                if not (0 <= start < 24 and 0 <= end < 24):
+                    raise ValueError
+            except ValueError:
+                await message.answer(
+                    'Укажите часы в формате /quiethours 23-7 '
+                    'или /quiethours off')
+                return
+            preferences.quiet_start, preferences.quiet_end = start, end
+
+        self.preferences.save(preferences)
+        await message.answer('Тихие часы сохранены')
+
+    async def timezone(
+        self,
+        message: Message,
+        state: FSMContext,
+        command: CommandObject
+    ) -> None:
+        preferences = self.preferences.get(message.from_user.id)
+        args = (command.args or '').strip()
+
+        if args == 'off':
+            preferences.timezone = None
+        else:
+            try:
+                ZoneInfo(args)
+            except (ValueError, ZoneInfoNotFoundError):
+                await message.answer(
+                    'Укажите часовой пояс, например /timezone Europe/Moscow')
+                return
+            preferences.timezone = args
+
+        self.preferences.save(preferences)
+        await message.answer('Часовой пояс сохранён')
+
+    async def digest(
+        self,
+        message: Message,
+        state: FSMContext,
+        command: CommandObject
+    ) -> None:
+        preferences = self.preferences.get(message.from_user.id)
+        try:
+            digest_interval = int((command.args or '').strip())
+            if digest_interval < 0:
+                raise ValueError
         except ValueError:
-            await message.answer('Пожалуйста, введите корректное число')
+            await message.answer(
+                'Укажите интервал в минутах, например /digest 60, '
+                'или /digest 0, чтобы отключить сводку')
+            return
+
+        preferences.digest_interval = digest_interval
+        self.preferences.save(preferences)
+        await message.answer('Интервал сводки сохранён')
+
+    async def debug(
+        self,
+        message: Message,
+        state: FSMContext,
+        command: CommandObject
+    ) -> None:
+        # Команда не показывается в меню и доступна только из ADMIN_IDS
+        if message.from_user.id not in self.admin_ids:
+            return
+
+        try:
+            duration = float(command.args or DEBUG_PROFILE_DURATION)
+            if duration <= 0:
+                raise ValueError
+        except ValueError:
+            await message.answer('Укажите длительность в секундах, '
+                                 'например /debug 10')
+            return
+
+        if self.profiler.running:
+            await message.answer('Профилирование уже запущено')
+            return
+
+        await message.answer(f'Профилирование {duration:g} с...')
+        report = await self.profiler.profile(duration)
+
+        response_lst = [
+            f'Блокировок event loop: {self.lag_monitor.stalls}',
+            'Максимальная задержка event loop: '
+            f'{self.lag_monitor.max_lag * 1000:.0f} мс',
+        ]
+        since = datetime.now() - timedelta(days=1)
+        percentiles = await asyncio.to_thread(
+            self.alert_log.latency_percentiles, since)
+        for p, latency in percentiles.items():
+            response_lst.append(f'Доставка уведомлений p{p}: {latency:.1f} с')
+
+        await message.answer_document(
+            BufferedInputFile(report.encode(), filename='profile.txt'),
+            caption='\n'.join(response_lst)
+        )
+
+    async def reload(
+        self,
+        message: Message,
+        state: FSMContext
+    ) -> None:
+        # Как и /debug, только для ADMIN_IDS
+        if message.from_user.id not in self.admin_ids:
+            return
+        if self.reloader is None:
+            return
+
+        try:
+            changes = self.reloader.reload()
+        except (ValueError, TypeError) as error:
+            await message.answer(f'Ошибка в .env, настройки не изменены: '
+                                 f'{error}')
+            return
+
+        response_lst = ['Настройки и правила перечитаны']
+        if changes:
+            response_lst.append('Изменено: ' + ', '.join(changes))
+        await message.answer('\n'.join(response_lst))
+        # Ответ уже отправлен старым Bot, теперь его можно заменить
+        await self.reloader.apply_token()
+
+    async def log_profile(self) -> None:
+        """Профилирование по SIGUSR1 с выводом в лог."""
+        if self.profiler.running:
+            logger.warning('Profiling is already running')
+            return
+        report = await self.profiler.profile(DEBUG_PROFILE_DURATION)
+        logger.info('Profile:\n%s', report)
 
     async def deletenotification(
         self,
         message: Message,
         state: FSMContext
     ) -> None:
-        con = sqlite3.connect(self.database_path)
-        with con:
-            cur = con.execute(
-                SELECT_USER_NOTIFICATIONS,
-                (message.from_user.id,)
-            )
-            notifications = [Notification(*row) for row in cur.fetchall()]
-        con.close()
+        chat_id = None
+        if message.chat.type != ChatType.PRIVATE:
+            chat_id = message.chat.id
+            if not await self.is_chat_admin(chat_id, message.from_user.id):
+                await message.answer(
+                    'Уведомления для чата могут настраивать только '
+                    'его администраторы')
+                return
+
+        notifications = self.chat_notifications(message)
 
         if not notifications:
             await message.answer('У вас нет активных уведомлений для удаления')
             return
 
-        await message.answer('Введите номер уведомления для удаления')
+        if chat_id is None:
+            await message.answer('Введите номер уведомления для удаления')
+        else:
+            await message.reply(
+                'Введите номер уведомления для удаления ответом на это '
+                'сообщение',
+                reply_markup=ForceReply(selective=True)
+            )
         notification_map = {i+1: n.id for i, n in enumerate(notifications)}
-        await state.update_data(notification_map=notification_map)
+        await state.update_data(
+            notification_map=notification_map, chat_id=chat_id)
         await state.set_state(DeleteNotificationStates.waiting_index)
 
     async def process_delete_index(
@@ -411,22 +1403,15 @@ class SensorBot:
 
             notification_id = notification_map[notification_index]
 
-            con = sqlite3.connect(self.database_path)
-            with con:
-                cur = con.execute(
-                    SELECT_USER_NOTIFICATION_BY_ID,
-                    (notification_id, message.from_user.id)
-                )
-                if not cur.fetchone():
-                    await message.answer(
-                        'Уведомление с таким номером не найдено')
-                    return
-
-                con.execute(
-                    DELETE_NOTIFICATION,
-                    (message.from_user.id, notification_id)
-                )
-            con.close()
+            if not await self.delete_notification(
+                message.from_user.id,
+                notification_id,
+                data.get('chat_id')
+            ):
+                await message.answer(
+                    'Уведомление с таким номером не найдено')
+                return
+
             await state.clear()
             await message.answer('Уведомление было успешно удалено!')
 
@@ -437,68 +1422,610 @@ class SensorBot:
         print(error)
 
 
-async def monitor_sensors(
-    bot: Bot,
-    ser,
-    database_path,
-    check_interval
-) -> None:
+def create_bot(token, api_url=None) -> Bot:
+    session = None
+    if api_url is not None:
+        # Локальный Bot API сервер или заглушка для тестов
+        session = AiohttpSession(api=TelegramAPIServer.from_base(api_url))
+    return Bot(token=token, session=session)
+
+
+async def supervise(name, factory) -> None:
+    """Перезапускает задачу после падения с экспоненциальной задержкой."""
+    loop = asyncio.get_running_loop()
+    backoff = SUPERVISOR_MIN_BACKOFF
     while True:
-        current_temperature = get_temperature(ser)
-        current_humidity = get_humidity(ser)
+        started_at = loop.time()
+        try:
+            await factory()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Task %s crashed', name)
+        else:
+            logger.warning('Task %s exited unexpectedly', name)
 
-        con = sqlite3.connect(database_path)
-        with con:
-            cur = con.execute(SELECT_NOTIFICATIONS)
-            notifications = tuple(
-                Notification(*row) for row in cur.fetchall())
-        con.close()
+        if loop.time() - started_at > SUPERVISOR_MAX_BACKOFF:
+            backoff = SUPERVISOR_MIN_BACKOFF
+        logger.info('Restarting task %s in %s s', name, backoff)
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, SUPERVISOR_MAX_BACKOFF)
+
+
+class SensorMonitor:
+    """Чтение датчиков -> проверка правил -> отправка уведомлений.
+
+    Каждый этап работает в отдельной задаче под supervise(), этапы связаны
+    ограниченными очередями.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        ser,
+        database_path,
+        check_interval,
+        preferences: PreferencesStore,
+        rules: RuleIndex,
+        alert_log: AlertLog,
+        min_check_interval=None
+    ):
+        self.bot = bot
+        self.ser = ser
+        self.database_path = database_path
+        self.check_interval = check_interval
+        self.scheduler = AdaptiveInterval(
+            min_check_interval or check_interval, check_interval)
+        self.preferences = preferences
+        self.rules = rules
+        self.alert_log = alert_log
+        self.outbox = Outbox(database_path)
+        self.readings = asyncio.Queue(maxsize=READINGS_QUEUE_SIZE)
+        self.alerts = asyncio.Queue(maxsize=ALERTS_QUEUE_SIZE)
+        # Получатели каждого нового показания (HTTP API и т.п.)
+        self.subscribers = []
+        # (parameter, condition, value) -> время последнего уведомления
+        self._alerted_at = {}
+        # Время последнего сохранённого кадра датчика
+        self._read_time = None
+        self._con = None
+        self._reader = None
+        self._workers = []
+        # Выставляется при кадре прошивки о пересечении порога
+        self._wakeup = asyncio.Event()
+        self._upload = None
+        self._outbox_ready = asyncio.Event()
+        self._telegram_down = False
+
+    def subscribe(self, callback) -> None:
+        self.subscribers.append(callback)
+
+    def is_idle(self) -> bool:
+        """Нет необработанных показаний и уведомлений к отправке."""
+        return (
+            self.readings.empty()
+            and self.alerts.empty()
+            and self.outbox.next_attempt_at() is None
+        )
+
+    def start(self) -> None:
+        if self.ser is not None:
+            self._start_reader()
+            self.rules.on_reload.append(self.upload_thresholds)
+            self.upload_thresholds(delay=FIRMWARE_BOOT_DELAY)
+
+        self._con = sqlite3.connect(self.database_path)
+        self.outbox.open()
+        self._reader = asyncio.create_task(
+            supervise('read_sensors', self.read_sensors))
+        self._workers = [
+            asyncio.create_task(supervise('evaluate', self.evaluate)),
+            asyncio.create_task(supervise('dispatch', self.dispatch)),
+            asyncio.create_task(
+                supervise('send_digests', self.send_digests)),
+            asyncio.create_task(
+                supervise('flush_alert_log', self.flush_alert_log)),
+            asyncio.create_task(supervise('deliver', self.deliver)),
+        ]
 
-        for notification in notifications:
-            user_id = notification.user_id
-            parameter = notification.parameter
-            condition = notification.condition
-            value = notification.value
-
-            match parameter:
-                case 'temperature':
-                    current = current_temperature
-                case 'humidity':
-                    current = current_humidity
-
-            conditions = (
-                condition == 'less' and current < value,
-                condition == 'greater' and current > value,
-                condition == 'equal' and current == value
+    def _start_reader(self) -> None:
+        loop = asyncio.get_running_loop()
+        start_reader(
+            self.ser,
+            on_alert=lambda: loop.call_soon_threadsafe(self._wakeup.set)
+        )
+
+    def set_intervals(self, check_interval, min_check_interval) -> None:
+        self.check_interval = check_interval
+        self.scheduler.min_interval = min_check_interval or check_interval
+        self.scheduler.max_interval = check_interval
+        self.scheduler.interval = min(
+            max(self.scheduler.interval, self.scheduler.min_interval),
+            self.scheduler.max_interval
+        )
+        if self.ser is not None:
+            set_sample_interval(self.ser, round(self.scheduler.interval))
+        # Не ждать окончания текущего, возможно долгого интервала
+        self._wakeup.set()
+
+    def replace_serial(self, ser) -> None:
+        """Переключает чтение на другой порт.
+
+        Поток чтения старого порта завершается при его закрытии. Nano
+        перезагружается при открытии порта, поэтому пороги и интервал
+        загружаются заново.
+        """
+        old, self.ser = self.ser, ser
+        self._start_reader()
+        old.close()
+        self.upload_thresholds(delay=FIRMWARE_BOOT_DELAY)
+
+    async def stop(self) -> None:
+        self._reader.cancel()
+        try:
+            await asyncio.wait_for(
+                self._drain(), timeout=SHUTDOWN_DRAIN_TIMEOUT)
+        except TimeoutError:
+            logger.warning(
+                'Monitor queues were not drained, %s alerts dropped',
+                self.alerts.qsize()
             )
 
-            if not any(conditions):
+        for task in self._workers:
+            task.cancel()
+        if self._upload is not None:
+            self._upload.cancel()
+        await asyncio.gather(
+            self._reader, *self._workers, return_exceptions=True)
+        self._con.close()
+        self.outbox.close()
+        self.alert_log.flush()
+
+    async def _drain(self) -> None:
+        await self.readings.join()
+        await self.alerts.join()
+
+    async def read_sensors(self) -> None:
+        while True:
+            # Время прихода последнего кадра от датчика, а не опроса.
+            # Показание сохраняется, только если с прошлого опроса пришёл
+            # новый кадр: иначе в базу попал бы повтор с тем же read_at,
+            # а при обрыве связи -- пустые значения
+            read_time = get_read_time(self.ser)
+            if read_time is not None and read_time != self._read_time:
+                self._read_time = read_time
+                reading = Reading(
+                    temperature=get_temperature(self.ser),
+                    humidity=get_humidity(self.ser),
+                    read_at=datetime.fromtimestamp(read_time),
+                )
+                await self.readings.put(reading)
+
+                previous_interval = round(self.scheduler.interval)
+                self.scheduler.update(reading, self.rules.thresholds)
+                if round(self.scheduler.interval) != previous_interval:
+                    set_sample_interval(
+                        self.ser, round(self.scheduler.interval))
+
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), self.scheduler.interval)
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def upload_thresholds(self, delay=0) -> None:
+        """Загружает пороги правил и текущий интервал опроса в прошивку.
+
+        Прошивка проверяет пороги на каждом замере и сразу присылает кадр,
+        если порог пересечён, не дожидаясь очередного опроса. Интервал
+        передаётся заново, потому что после перезагрузки Nano он сброшен
+        к 60 с.
+        """
+        if self._upload is not None:
+            self._upload.cancel()
+        commands = threshold_table_commands(self.rules.groups)
+        self._upload = asyncio.create_task(
+            self._send_commands(commands, delay))
+
+    async def _send_commands(self, commands, delay) -> None:
+        await asyncio.sleep(delay)
+        for command in commands:
+            send_command(self.ser, command)
+            await asyncio.sleep(FIRMWARE_COMMAND_DELAY)
+        set_sample_interval(self.ser, round(self.scheduler.interval))
+
+    async def evaluate(self) -> None:
+        while True:
+            reading = await self.readings.get()
+            try:
+                with self._con:
+                    self._con.execute(INSERT_READING, (
+                        reading.temperature,
+                        reading.humidity,
+                        reading.read_at.isoformat(),
+                    ))
+                for callback in self.subscribers:
+                    try:
+                        callback(reading)
+                    except Exception:
+                        logger.exception('Reading subscriber %r failed',
+                                         callback)
+                for alert in self.match_notifications(reading):
+                    alert.enqueued_at = datetime.now()
+                    await self.alerts.put(alert)
+            finally:
+                self.readings.task_done()
+
+    def match_notifications(self, reading):
+        """Уведомления по сработавшим группам правил.
+
+        Пересечение порога уведомляет сразу, но пока условие держится,
+        группа повторяет уведомление не чаще раза в check_interval, как
+        при опросе с постоянным интервалом: ускоренный опрос у порога
+        не должен учащать одинаковые сообщения.
+        """
+        alerted_at = {}
+        for group in self.rules.match(reading):
+            key = (group.rule.parameter, group.rule.condition,
+                   group.rule.value)
+            last = self._alerted_at.get(key)
+            if last is not None and (
+                (reading.read_at - last).total_seconds() < self.check_interval
+            ):
+                alerted_at[key] = last
                 continue
+            alerted_at[key] = reading.read_at
+
+            for rule_id, user_id, urgent in group.subscribers():
+                yield Alert(
+                    rule_id=rule_id,
+                    user_id=user_id,
+                    message=group.messages[urgent],
+                    urgent=urgent,
+                    read_at=reading.read_at,
+                )
+        # Группы, условие которых перестало выполняться, забываются:
+        # следующее пересечение уведомит сразу
+        self._alerted_at = alerted_at
+
+    async def dispatch(self) -> None:
+        while True:
+            alert = await self.alerts.get()
+            try:
+                preferences = self.preferences.get(alert.user_id)
+                if alert.urgent or not preferences.defers_alerts():
+                    self.enqueue(
+                        alert_key(alert), alert.user_id, alert.message,
+                        (alert,))
+                else:
+                    # Отложенное уведомление сразу пишется в базу и
+                    # переживает перезапуск до отправки сводки
+                    self.outbox.defer(
+                        alert.user_id, alerts_to_json((alert,)), time.time())
+            finally:
+                self.alerts.task_done()
+
+    async def send_digests(self) -> None:
+        while True:
+            await asyncio.sleep(DIGEST_CHECK_INTERVAL)
+            now = time.time()
+
+            for user_id, deferred_at in self.outbox.deferred_users():
+                preferences = self.preferences.get(user_id)
+                if preferences.is_quiet():
+                    continue
+
+                # Сводка уходит, когда самому старому уведомлению в ней
+                # исполнился digest_interval
+                interval = preferences.digest_interval * 60
+                if now - deferred_at < interval:
+                    continue
+
+                self.enqueue_digest(user_id)
+
+    async def flush_alert_log(self) -> None:
+        while True:
+            await asyncio.sleep(ALERT_LOG_FLUSH_INTERVAL)
+            self.alert_log.flush()
+
+    def enqueue(self, key, user_id, message, alerts, release=()) -> None:
+        self.outbox.enqueue(
+            key, user_id, message, alerts_to_json(alerts), time.time(),
+            release)
+        self._outbox_ready.set()
+
+    def enqueue_digest(self, user_id) -> None:
+        """Собирает отложенные уведомления пользователя в сводку."""
+        rows = self.outbox.deferred(user_id)
+        if not rows:
+            return
 
-            message = f'Сработало уведомление {notification}'
-            await bot.send_message(user_id, message)
+        alerts = [
+            alert for _, text in rows for alert in alerts_from_json(text)]
+        self.enqueue(
+            f'digest:{alert_key(alerts[0])}',
+            user_id,
+            format_digest(alerts),
+            alerts,
+            release=[id_ for id_, _ in rows],
+        )
 
-        await asyncio.sleep(check_interval)
+    async def deliver(self) -> None:
+        while True:
+            now = time.time()
+            for item in self.outbox.pop_expired(now):
+                logger.warning('Alert for %s expired undelivered',
+                               item.user_id)
+                self.record(
+                    alerts_from_json(item.alerts), 'expired', item.attempts)
+
+            items = self.outbox.due(now, OUTBOX_BATCH_SIZE)
+            if not items:
+                next_attempt_at = self.outbox.next_attempt_at()
+                if next_attempt_at is None:
+                    timeout = OUTBOX_IDLE_INTERVAL
+                else:
+                    timeout = max(next_attempt_at - now, 0)
+                try:
+                    await asyncio.wait_for(
+                        self._outbox_ready.wait(), timeout)
+                except TimeoutError:
+                    pass
+                self._outbox_ready.clear()
+                continue
+
+            for item in items:
+                if not await self.deliver_item(item):
+                    break
+                await asyncio.sleep(1 / OUTBOX_RATE)
+
+    async def deliver_item(self, item) -> bool:
+        """Отправляет сообщение из очереди; False, если Telegram
+        недоступен и отправку стоит приостановить."""
+        try:
+            await self.bot.send_message(item.user_id, item.message)
+        except TelegramRetryAfter as error:
+            self.outbox.retry(item, time.time(), error.retry_after)
+            await asyncio.sleep(error.retry_after)
+            return True
+        except (TelegramNetworkError, TelegramServerError) as error:
+            logger.warning('Telegram unavailable, alert for %s postponed: '
+                           '%s', item.user_id, error)
+            self.outbox.retry(item, time.time())
+            self.outbox.postpone_all(item.next_attempt_at)
+            self._telegram_down = True
+            return False
+        except TelegramAPIError as error:
+            # Ошибка не временная (бот заблокирован, чат не найден и т.п.)
+            logger.warning('Failed to notify %s: %s', item.user_id, error)
+            self.outbox.complete(item)
+            self.record(
+                alerts_from_json(item.alerts), str(error), item.attempts)
+            return True
+
+        self.outbox.complete(item)
+        self.record(alerts_from_json(item.alerts), 'ok', item.attempts)
+        if self._telegram_down:
+            # Связь восстановилась: отправляем накопленное без пауз
+            self._telegram_down = False
+            self.outbox.retry_all(time.time())
+        return True
+
+    def record(self, alerts, result, retries=0) -> None:
+        sent_at = datetime.now()
+        for alert in alerts:
+            alert.sent_at = sent_at
+            alert.result = result
+            alert.retries = retries
+            self.alert_log.record(alert)
+
+
+def format_digest(alerts) -> str:
+    messages = Counter(alert.message for alert in alerts)
+    lines = ['Сводка уведомлений:']
+    for message, count in messages.items():
+        if count > 1:
+            message += f' (x{count})'
+        lines.append(message)
+    return '\n'.join(lines)
+
+
+class ConfigReloader:
+    """Перечитывает .env и применяет изменения без перезапуска.
+
+    Индекс правил и настройки пользователей перестраиваются из базы
+    целиком и подменяются одним присваиванием, поэтому проверка правил
+    не видит их частично построенными.
+    """
+
+    # Эти настройки применяются только при перезапуске
+    RESTART_REQUIRED = (
+        'database_path',
+        'api_host',
+        'api_port',
+        'mqtt_host',
+        'mqtt_port',
+        'mqtt_sensor_id',
+        'mqtt_username',
+        'mqtt_password',
+    )
+
+    def __init__(self, config, bot, monitor, retention):
+        self.config = config
+        self.bot = bot
+        self.monitor = monitor
+        self.retention = retention
+        self._replace_bot = False
+
+    def reload(self) -> list:
+        """Применяет изменённые настройки и возвращает их имена.
+
+        Новый токен применяется отдельно в apply_token(): после замены
+        Bot ответить через старый уже нельзя.
+        """
+        config = Config.from_env()
+        changes = [
+            field.name for field in fields(Config)
+            if getattr(config, field.name) != getattr(self.config, field.name)
+        ]
+
+        # Правила перестраиваются до смены порта: иначе загрузка порогов
+        # после reload() отменила бы загрузку с задержкой на время
+        # перезагрузки Nano
+        self.bot.rules.reload()
+        self.bot.preferences.load()
+
+        if 'port' in changes:
+            try:
+                ser = serial_for_url(config.port)
+            except SerialException as error:
+                logger.warning('Cannot open %s, keeping %s: %s',
+                               config.port, self.config.port, error)
+                config.port = self.config.port
+                changes.remove('port')
+            else:
+                self.monitor.replace_serial(ser)
+                self.bot.ser = ser
+
+        for name in self.RESTART_REQUIRED:
+            if name in changes:
+                logger.warning('%s changed, restart to apply it', name)
+                setattr(config, name, getattr(self.config, name))
+                changes.remove(name)
+
+        if {'check_interval', 'min_check_interval'} & set(changes):
+            self.monitor.set_intervals(
+                config.check_interval, config.min_check_interval)
+        self.bot.rate_limiter.rate = config.rate_limit
+        self.bot.rate_limiter.burst = config.rate_burst
+        self.bot.max_rules = config.max_rules
+        self.bot.admin_ids = config.admin_ids
+        self.bot.lag_monitor.threshold = config.loop_lag_threshold / 1000
+        self.retention.retention_days = {
+            'readings': config.readings_retention,
+            'alert_events': config.alert_events_retention,
+        }
+
+        self._replace_bot = 'token' in changes or 'api_url' in changes
+        self.config = config
+        logger.info('Configuration reloaded, changed: %s',
+                    ', '.join(changes) or 'nothing')
+        return changes
+
+    async def apply_token(self) -> None:
+        if not self._replace_bot:
+            return
+        self._replace_bot = False
+        bot = create_bot(self.config.token, self.config.api_url)
+        # Монитор переключается до остановки опроса: иначе отправка из
+        # очереди снова откроет сессию старого Bot со старым токеном
+        self.monitor.bot = bot
+        await self.bot.replace_bot(bot)
+
+    async def reload_on_signal(self) -> None:
+        try:
+            self.reload()
+        except (ValueError, TypeError) as error:
+            logger.error('Invalid .env, configuration kept: %s', error)
+            return
+        await self.apply_token()
 
 
 async def main() -> None:
     config = Config.from_env()
-    ser = Serial(config.port)
+    ser = serial_for_url(config.port)
     bot = SensorBot(
         token=config.token,
         ser=ser,
-        database_path=config.database_path
+        database_path=config.database_path,
+        rate_limit=config.rate_limit,
+        rate_burst=config.rate_burst,
+        max_rules=config.max_rules,
+        api_url=config.api_url,
+        admin_ids=config.admin_ids,
+        loop_lag_threshold=config.loop_lag_threshold
+    )
+    bot.lag_monitor.start()
+
+    monitor = SensorMonitor(
+        bot.bot,
+        ser,
+        config.database_path,
+        config.check_interval,
+        bot.preferences,
+        bot.rules,
+        bot.alert_log,
+        config.min_check_interval
+    )
+    monitor.start()
+
+    api = None
+    if config.api_port is not None:
+        api = ReadingsApi(
+            config.database_path, config.api_host, config.api_port)
+        monitor.subscribe(api.publish)
+        await api.start()
+
+    retention = Retention(
+        config.database_path,
+        config.readings_retention,
+        config.alert_events_retention,
+        is_idle=monitor.is_idle,
     )
+    retention_task = asyncio.create_task(
+        supervise('retention', retention.run))
 
-    asyncio.create_task(
-        monitor_sensors(
-            bot.bot,
-            ser,
-            config.database_path,
-            config.check_interval
+    reloader = ConfigReloader(config, bot, monitor, retention)
+    bot.reloader = reloader
+
+    # kill -USR1 <pid> снимает профиль, kill -HUP <pid> перечитывает .env
+    signal_tasks = set()
+
+    def add_signal_task(name, factory):
+        def handler():
+            task = asyncio.create_task(factory())
+            signal_tasks.add(task)
+            task.add_done_callback(signal_tasks.discard)
+
+        try:
+            asyncio.get_running_loop().add_signal_handler(
+                getattr(signal, name), handler)
+        except (AttributeError, NotImplementedError):
+            # Windows: сигнала нет или loop не поддерживает обработчики
+            pass
+
+    add_signal_task('SIGUSR1', bot.log_profile)
+    add_signal_task('SIGHUP', reloader.reload_on_signal)
+
+    mqtt_task = None
+    if config.mqtt_host is not None:
+        bridge = MqttBridge(
+            bot,
+            config.mqtt_host,
+            config.mqtt_port,
+            config.mqtt_sensor_id,
+            config.mqtt_username,
+            config.mqtt_password,
         )
-    )
-    await bot.start_polling()
+        monitor.subscribe(bridge.publish)
+        mqtt_task = asyncio.create_task(supervise('mqtt', bridge.run))
+
+    # start_polling сам обрабатывает SIGINT/SIGTERM и завершается,
+    # после чего дочитываем очереди и закрываем ресурсы
+    try:
+        await bot.start_polling()
+    finally:
+        retention_task.cancel()
+        if mqtt_task is not None:
+            mqtt_task.cancel()
+        if api is not None:
+            await api.stop()
+        await monitor.stop()
+        bot.lag_monitor.stop()
+        monitor.ser.close()
+        await bot.bot.session.close()
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     asyncio.run(main())
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import logging
+from collections import deque
+
+try:
+    import aiomqtt
+except ImportError:  # MQTT необязателен
+    aiomqtt = None
+
+logger = logging.getLogger(__name__)
+
+MQTT_QOS = 1
+# Сколько показаний хранить, пока брокер недоступен; старые вытесняются
+MQTT_BUFFER_SIZE = 1000
+
+RULE_PARAMETERS = ('temperature', 'humidity')
+RULE_CONDITIONS = ('less', 'equal', 'greater')
+
+
+class MqttBridge:
+    """Публикует показания в MQTT и принимает изменения правил.
+
+    Показания уходят в sensors/<id>/temperature и sensors/<id>/humidity
+    с QoS 1 и флагом retain. Правила принимаются JSON-сообщениями в
+    sensors/<id>/rules/set:
+
+        {"action": "add", "user_id": 1, "parameter": "temperature",
+         "condition": "greater", "value": 30, "urgent": false}
+        {"action": "delete", "user_id": 1, "id": 5}
+
+    Правила для групп и каналов через MQTT не принимаются: у MQTT-клиента
+    нельзя проверить, что он администратор чата.
+
+    run() завершается ошибкой при потере соединения, переподключение
+    с задержкой выполняет supervise().
+    """
+
+    def __init__(
+        self,
+        rules,
+        host,
+        port=1883,
+        sensor_id='nano',
+        username=None,
+        password=None,
+        buffer_size=MQTT_BUFFER_SIZE
+    ):
+        if aiomqtt is None:
+            raise RuntimeError(
+                'MQTT_HOST is set, but aiomqtt is not installed '
+                '(pip install aiomqtt)')
+
+        self.rules = rules
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.topic_prefix = f'sensors/{sensor_id}'
+        self._buffer = deque(maxlen=buffer_size)
+        self._pending = asyncio.Event()
+
+    def publish(self, reading) -> None:
+        for parameter in RULE_PARAMETERS:
+            value = getattr(reading, parameter)
+            if value is not None:
+                self._buffer.append(
+                    (f'{self.topic_prefix}/{parameter}', str(value)))
+        self._pending.set()
+
+    async def run(self) -> None:
+        async with aiomqtt.Client(
+            self.host,
+            self.port,
+            username=self.username,
+            password=self.password,
+        ) as client:
+            logger.info('Connected to MQTT broker %s:%s',
+                        self.host, self.port)
+            await client.subscribe(
+                f'{self.topic_prefix}/rules/set', qos=MQTT_QOS)
+            async with asyncio.TaskGroup() as group:
+                group.create_task(self._publish_loop(client))
+                group.create_task(self._rules_loop(client))
+
+    async def _publish_loop(self, client) -> None:
+        while True:
+            await self._pending.wait()
+            # Показание удаляется из буфера только после подтверждения,
+            # поэтому при обрыве связи оно будет отправлено повторно
+            while self._buffer:
+                topic, payload = self._buffer[0]
+                await client.publish(
+                    topic, payload, qos=MQTT_QOS, retain=True)
+                self._buffer.popleft()
+            self._pending.clear()
+
+    async def _rules_loop(self, client) -> None:
+        async for message in client.messages:
+            try:
+                await self.apply_rule_change(json.loads(message.payload))
+            except (ValueError, KeyError, TypeError) as error:
+                logger.warning('Rejected MQTT rule change %r: %s',
+                               message.payload, error)
+
+    async def apply_rule_change(self, change) -> None:
+        user_id = int(change['user_id'])
+        match change['action']:
+            case 'add':
+                if change.get('chat_id') is not None:
+                    raise ValueError('chat rules are managed in Telegram')
+                if change['parameter'] not in RULE_PARAMETERS:
+                    raise ValueError('unknown parameter')
+                if change['condition'] not in RULE_CONDITIONS:
+                    raise ValueError('unknown condition')
+                await self.rules.add_notification(
+                    user_id,
+                    change['parameter'],
+                    change['condition'],
+                    float(change['value']),
+                    bool(change.get('urgent', False)),
+                )
+            case 'delete':
+                await self.rules.delete_notification(
+                    user_id, int(change['id']))
+            case _:
+                raise ValueError('unknown action')
@@ -0,0 +1,204 @@
+import sqlite3
+from dataclasses import dataclass
+
+# Уведомление старше этого срока уже неактуально и не отправляется
+OUTBOX_TTL = 60 * 60
+OUTBOX_MIN_BACKOFF = 1
+OUTBOX_MAX_BACKOFF = 5 * 60
+
+CREATE_OUTBOX_TABLE = '''
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT UNIQUE,
+    user_id INTEGER,
+    message TEXT,
+    alerts TEXT,
+    attempts INTEGER DEFAULT 0,
+    next_attempt_at REAL,
+    expires_at REAL
+)
+'''
+
+CREATE_OUTBOX_INDEX = '''
+CREATE INDEX IF NOT EXISTS outbox_next_attempt_at
+ON outbox (next_attempt_at)
+'''
+
+INSERT_OUTBOX_ITEM = '''
+INSERT OR IGNORE INTO outbox (
+    idempotency_key,
+    user_id,
+    message,
+    alerts,
+    next_attempt_at,
+    expires_at
+) VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+SELECT_DUE_OUTBOX_ITEMS = '''
+SELECT id, idempotency_key, user_id, message, alerts, attempts,
+       next_attempt_at, expires_at
+FROM outbox
+WHERE next_attempt_at <= ? AND expires_at > ?
+ORDER BY next_attempt_at, attempts DESC, id
+LIMIT ?
+'''
+
+SELECT_EXPIRED_OUTBOX_ITEMS = '''
+SELECT id, idempotency_key, user_id, message, alerts, attempts,
+       next_attempt_at, expires_at
+FROM outbox
+WHERE expires_at <= ?
+'''
+
+SELECT_NEXT_ATTEMPT_AT = '''
+SELECT MIN(next_attempt_at) FROM outbox
+'''
+
+UPDATE_OUTBOX_RETRY = '''
+UPDATE outbox SET attempts=?, next_attempt_at=? WHERE id=?
+'''
+
+UPDATE_OUTBOX_RETRY_ALL = '''
+UPDATE outbox SET next_attempt_at=? WHERE next_attempt_at > ?
+'''
+
+UPDATE_OUTBOX_POSTPONE_ALL = '''
+UPDATE outbox SET next_attempt_at=? WHERE next_attempt_at < ?
+'''
+
+DELETE_OUTBOX_ITEM = '''
+DELETE FROM outbox WHERE id=?
+'''
+
+# Несрочные уведомления, ожидающие сводки или конца тихих часов
+CREATE_DEFERRED_ALERTS_TABLE = '''
+CREATE TABLE IF NOT EXISTS deferred_alerts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    alert TEXT,
+    deferred_at REAL
+)
+'''
+
+CREATE_DEFERRED_ALERTS_INDEX = '''
+CREATE INDEX IF NOT EXISTS deferred_alerts_user_id
+ON deferred_alerts (user_id)
+'''
+
+INSERT_DEFERRED_ALERT = '''
+INSERT INTO deferred_alerts (user_id, alert, deferred_at) VALUES (?, ?, ?)
+'''
+
+SELECT_DEFERRED_USERS = '''
+SELECT user_id, MIN(deferred_at) FROM deferred_alerts GROUP BY user_id
+'''
+
+SELECT_DEFERRED_ALERTS = '''
+SELECT id, alert FROM deferred_alerts WHERE user_id=? ORDER BY id
+'''
+
+DELETE_DEFERRED_ALERT = '''
+DELETE FROM deferred_alerts WHERE id=?
+'''
+
+
+@dataclass(slots=True)
+class OutboxItem:
+    id: int
+    idempotency_key: str
+    user_id: int
+    message: str
+    # Alert-ы, из которых собрано сообщение, в JSON
+    alerts: str
+    attempts: int
+    next_attempt_at: float
+    expires_at: float
+
+
+class Outbox:
+    """Очередь исходящих сообщений в SQLite.
+
+    Сообщение удаляется из очереди только после ответа Telegram, поэтому
+    переживает перезапуск и недоступность API (доставка at-least-once).
+    Повторная постановка с тем же idempotency_key игнорируется.
+    """
+
+    def __init__(self, database_path):
+        self.database_path = database_path
+        self._con = None
+
+    def open(self):
+        self._con = sqlite3.connect(self.database_path)
+
+    def close(self):
+        self._con.close()
+
+    def enqueue(self, key, user_id, message, alerts, now, release=()):
+        """Ставит сообщение в очередь.
+
+        release -- id отложенных уведомлений, собранных в это сообщение;
+        они удаляются в той же транзакции.
+        """
+        with self._con:
+            cur = self._con.execute(INSERT_OUTBOX_ITEM, (
+                key, user_id, message, alerts, now, now + OUTBOX_TTL))
+            self._con.executemany(
+                DELETE_DEFERRED_ALERT, ((id_,) for id_ in release))
+        return cur.rowcount > 0
+
+    def defer(self, user_id, alert, now):
+        with self._con:
+            self._con.execute(INSERT_DEFERRED_ALERT, (user_id, alert, now))
+
+    def deferred_users(self):
+        """Пары (user_id, время самого старого отложенного уведомления)."""
+        return self._con.execute(SELECT_DEFERRED_USERS).fetchall()
+
+    def deferred(self, user_id):
+        """Отложенные уведомления пользователя: пары (id, alert в JSON)."""
+        return self._con.execute(SELECT_DEFERRED_ALERTS, (user_id,)).fetchall()
+
+    def due(self, now, limit):
+        cur = self._con.execute(SELECT_DUE_OUTBOX_ITEMS, (now, now, limit))
+        return [OutboxItem(*row) for row in cur]
+
+    def pop_expired(self, now):
+        cur = self._con.execute(SELECT_EXPIRED_OUTBOX_ITEMS, (now,))
+        items = [OutboxItem(*row) for row in cur]
+        with self._con:
+            self._con.executemany(
+                DELETE_OUTBOX_ITEM, ((item.id,) for item in items))
+        return items
+
+    def next_attempt_at(self):
+        return self._con.execute(SELECT_NEXT_ATTEMPT_AT).fetchone()[0]
+
+    def complete(self, item):
+        with self._con:
+            self._con.execute(DELETE_OUTBOX_ITEM, (item.id,))
+
+    def retry(self, item, now, delay=None):
+        """Откладывает сообщение; без delay -- с экспоненциальной паузой."""
+        item.attempts += 1
+        if delay is None:
+            delay = min(
+                OUTBOX_MIN_BACKOFF * 2 ** (item.attempts - 1),
+                OUTBOX_MAX_BACKOFF
+            )
+        item.next_attempt_at = now + delay
+        with self._con:
+            self._con.execute(UPDATE_OUTBOX_RETRY, (
+                item.attempts, item.next_attempt_at, item.id))
+
+    def postpone_all(self, until):
+        """Откладывает все сообщения до until, пока Telegram недоступен:
+        связь проверяется одним сообщением, а не всей очередью."""
+        with self._con:
+            self._con.execute(UPDATE_OUTBOX_POSTPONE_ALL, (until, until))
+
+    def retry_all(self, now):
+        """Снимает паузы у всех сообщений, например после восстановления
+        связи с Telegram."""
+        with self._con:
+            self._con.execute(UPDATE_OUTBOX_RETRY_ALL, (now, now))
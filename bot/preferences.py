@@ -0,0 +1,94 @@
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+CREATE_PREFERENCES_TABLE = '''
+CREATE TABLE IF NOT EXISTS preferences (
+    user_id INTEGER PRIMARY KEY,
+    quiet_start INTEGER,
+    quiet_end INTEGER,
+    timezone TEXT,
+    digest_interval INTEGER DEFAULT 0
+)
+'''
+
+SELECT_PREFERENCES = '''
+SELECT user_id, quiet_start, quiet_end, timezone, digest_interval
+FROM preferences
+'''
+
+UPSERT_PREFERENCES = '''
+INSERT OR REPLACE INTO preferences (
+    user_id,
+    quiet_start,
+    quiet_end,
+    timezone,
+    digest_interval
+) VALUES (?, ?, ?, ?, ?)
+'''
+
+
+@dataclass(slots=True)
+class Preferences:
+    user_id: int
+    # Тихие часы задаются часами [quiet_start, quiet_end) по местному
+    # времени пользователя и могут переходить через полночь
+    quiet_start: int | None = None
+    quiet_end: int | None = None
+    timezone: str | None = None
+    # Интервал сводки в минутах, 0 -- сводка отключена
+    digest_interval: int = 0
+
+    def local_now(self):
+        if self.timezone is None:
+            return datetime.now()
+        return datetime.now(ZoneInfo(self.timezone))
+
+    def is_quiet(self, now=None):
+        if self.quiet_start is None or self.quiet_end is None:
+            return False
+
+        hour = (now or self.local_now()).hour
+        if self.quiet_start <= self.quiet_end:
+            return self.quiet_start <= hour < self.quiet_end
+        return hour >= self.quiet_start or hour < self.quiet_end
+
+    def defers_alerts(self, now=None):
+        return self.digest_interval > 0 or self.is_quiet(now)
+
+
+class PreferencesStore:
+    """Настройки доставки в памяти с записью в базу при изменении."""
+
+    def __init__(self, database_path):
+        self.database_path = database_path
+        self._preferences = {}
+
+    def load(self):
+        con = sqlite3.connect(self.database_path)
+        with con:
+            cur = con.execute(SELECT_PREFERENCES)
+            self._preferences = {
+                row[0]: Preferences(*row) for row in cur
+            }
+        con.close()
+
+    def get(self, user_id):
+        preferences = self._preferences.get(user_id)
+        if preferences is None:
+            return Preferences(user_id)
+        return preferences
+
+    def save(self, preferences):
+        con = sqlite3.connect(self.database_path)
+        with con:
+            con.execute(UPSERT_PREFERENCES, (
+                preferences.user_id,
+                preferences.quiet_start,
+                preferences.quiet_end,
+                preferences.timezone,
+                preferences.digest_interval,
+            ))
+        con.close()
+        self._preferences[preferences.user_id] = preferences
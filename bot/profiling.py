@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Частота выборки стеков профилировщиком, секунды
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_MAX_DURATION = 60
+PROFILE_TOP_STACKS = 20
+
+
+class SamplingProfiler:
+    """Выборочный профилировщик всех потоков процесса.
+
+    Отдельный поток периодически снимает стеки через
+    sys._current_frames(), поэтому видны и event loop, и поток чтения
+    порта, а сам профилировщик почти не тормозит бота. Одновременно
+    работает только одна сессия.
+    """
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._lock.locked()
+
+    async def profile(self, duration, top=PROFILE_TOP_STACKS) -> str:
+        duration = min(duration, PROFILE_MAX_DURATION)
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError('Profiling is already running')
+        try:
+            samples, stacks = await asyncio.to_thread(self._sample, duration)
+        finally:
+            self._lock.release()
+        return format_stacks(samples, stacks, top)
+
+    def _sample(self, duration):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = Counter()
+        samples = 0
+
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = tuple(
+                    f'{frame.f_code.co_filename}:{lineno} '
+                    f'{frame.f_code.co_name}'
+                    for frame, lineno in traceback.walk_stack(frame)
+                )
+                stacks[names.get(ident, ident), stack] += 1
+            samples += 1
+            time.sleep(self.interval)
+
+        return samples, stacks
+
+
+def format_stacks(samples, stacks, top=PROFILE_TOP_STACKS) -> str:
+    lines = [f'{samples} samples']
+    for (thread, stack), count in stacks.most_common(top):
+        lines.append('')
+        lines.append(f'{count / samples:6.1%}  [{thread}]')
+        # Стек от вызова верхнего уровня к текущей функции
+        lines.extend(f'    {frame}' for frame in reversed(stack))
+    return '\n'.join(lines)
+
+
+class LoopLagMonitor:
+    """Следит, чтобы event loop не блокировался дольше threshold секунд.
+
+    Задача в loop периодически засыпает и отмечает, когда должна
+    проснуться. Сторожевой поток, заметив, что она опаздывает дольше
+    порога, пишет в лог стек loop-а в этот момент, то есть стек
+    блокирующего callback-а. Задержка считается от ожидаемого времени
+    пробуждения, поэтому собственный сон задачи в неё не входит.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.stalls = 0
+        self.max_lag = 0.0
+        # Когда задача heartbeat должна проснуться
+        self._due = time.monotonic()
+        self._loop_thread = None
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        self._loop_thread = threading.get_ident()
+        self._due = time.monotonic()
+        self._task = asyncio.create_task(self.heartbeat())
+        self._watchdog = threading.Thread(
+            target=self._watch,
+            name='loop-lag-monitor',
+            daemon=True,
+        )
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def heartbeat(self) -> None:
+        while True:
+            # Порог может измениться при перечитывании настроек
+            interval = self.threshold / 2
+            due = time.monotonic() + interval
+            self._due = due
+            await asyncio.sleep(interval)
+            self.max_lag = max(self.max_lag, time.monotonic() - due)
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stopped.wait(self.threshold / 4):
+            due = self._due
+            lag = time.monotonic() - due
+            if lag < self.threshold or due == reported:
+                continue
+
+            # Об одной блокировке сообщаем один раз
+            reported = due
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = ''.join(traceback.format_stack(frame)) if frame else ''
+            logger.warning('Event loop blocked for %.0f ms:\n%s',
+                           lag * 1000, stack)
@@ -0,0 +1,74 @@
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message
+
+# Сколько пользователей помнить; давно неактивные вытесняются
+RATE_LIMIT_CACHE_SIZE = 10_000
+
+RATE_LIMIT_MESSAGE = 'Слишком много запросов, попробуйте позже'
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated_at', 'warned')
+
+    def __init__(self, tokens, updated_at):
+        self.tokens = tokens
+        self.updated_at = updated_at
+        self.warned = False
+
+
+class RateLimitMiddleware(BaseMiddleware):
+    """Ограничение частоты запросов на пользователя (token bucket).
+
+    У каждого пользователя до burst запросов, запас пополняется со
+    скоростью rate запросов в секунду. Сверх лимита событие не доходит
+    до обработчика, а предупреждение отправляется один раз, пока запас
+    не восстановится.
+    """
+
+    def __init__(self, rate, burst, maxsize=RATE_LIMIT_CACHE_SIZE):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        if user is None:
+            return await handler(event, data)
+
+        bucket = self.consume(user.id, time.monotonic())
+        if bucket is None:
+            return await handler(event, data)
+
+        if not bucket.warned:
+            bucket.warned = True
+            if isinstance(event, Message):
+                await event.answer(RATE_LIMIT_MESSAGE)
+            elif isinstance(event, CallbackQuery):
+                await event.answer(RATE_LIMIT_MESSAGE)
+        return None
+
+    def consume(self, user_id, now):
+        """Списывает запрос; возвращает бакет, если лимит исчерпан."""
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.burst, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+            bucket.tokens = min(
+                self.burst,
+                bucket.tokens + (now - bucket.updated_at) * self.rate
+            )
+            bucket.updated_at = now
+
+        if bucket.tokens < 1:
+            return bucket
+
+        bucket.tokens -= 1
+        bucket.warned = False
+        return None
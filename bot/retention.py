@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import sqlite3
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Как часто удалять устаревшие строки, секунды
+RETENTION_INTERVAL = 60 * 60
+# Удаление порциями: блокировка записи держится недолго, между порциями
+# успевают записаться показания
+RETENTION_CHUNK_SIZE = 500
+RETENTION_CHUNK_PAUSE = 0.1
+# Сырые показания сворачиваются в почасовые средние по суткам
+ROLLUP_WINDOW = timedelta(days=1)
+# Сколько свободных страниц возвращать файловой системе за шаг
+VACUUM_STEP_PAGES = 256
+VACUUM_STEP_PAUSE = 1
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+CREATE_READINGS_HOURLY_TABLE = '''
+CREATE TABLE IF NOT EXISTS readings_hourly (
+    hour INTEGER PRIMARY KEY,
+    temperature REAL,
+    humidity REAL,
+    samples INTEGER
+)
+'''
+
+SELECT_OLDEST_READING = '''
+SELECT MIN(read_at) FROM readings WHERE read_at < ?
+'''
+
+# Час, который уже свёрнут, не пересчитывается: при повторном проходе
+# после прерванного удаления его сырые данные могут быть неполными
+INSERT_READINGS_HOURLY = '''
+INSERT OR IGNORE INTO readings_hourly (hour, temperature, humidity, samples)
+SELECT
+    CAST(strftime('%s', read_at) AS INTEGER) / 3600 AS hour,
+    AVG(temperature),
+    AVG(humidity),
+    COUNT(*)
+FROM readings
+WHERE read_at >= ? AND read_at < ?
+GROUP BY hour
+'''
+
+DELETE_OLD_ROWS = {
+    'readings': '''
+        DELETE FROM readings WHERE id IN (
+            SELECT id FROM readings WHERE read_at < ? LIMIT ?
+        )
+    ''',
+    'alert_events': '''
+        DELETE FROM alert_events WHERE id IN (
+            SELECT id FROM alert_events WHERE read_at < ? LIMIT ?
+        )
+    ''',
+}
+
+
+def enable_incremental_vacuum(con):
+    """Включает auto_vacuum=INCREMENTAL.
+
+    У существующей базы режим меняется только через VACUUM, поэтому при
+    первом запуске после обновления база один раз перестраивается.
+    """
+    mode = con.execute('PRAGMA auto_vacuum').fetchone()[0]
+    if mode != AUTO_VACUUM_INCREMENTAL:
+        con.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        con.execute('VACUUM')
+
+
+class Retention:
+    """Фоновая очистка базы по срокам хранения.
+
+    Сырые показания старше readings_days сворачиваются в readings_hourly,
+    которая хранится бессрочно, и удаляются; события уведомлений удаляются
+    через alert_events_days. Срок 0 -- хранить всё. Освободившиеся
+    страницы возвращаются инкрементальным VACUUM, пока is_idle() истинно.
+    """
+
+    def __init__(
+        self,
+        database_path,
+        readings_days,
+        alert_events_days,
+        is_idle=None
+    ):
+        self.database_path = database_path
+        self.retention_days = {
+            'readings': readings_days,
+            'alert_events': alert_events_days,
+        }
+        self.is_idle = is_idle or (lambda: True)
+        self._con = None
+
+    async def run(self) -> None:
+        self._con = sqlite3.connect(
+            self.database_path, check_same_thread=False)
+        try:
+            while True:
+                await self.prune()
+                await self.vacuum()
+                await asyncio.sleep(RETENTION_INTERVAL)
+        finally:
+            self._con.close()
+
+    async def prune(self) -> None:
+        now = datetime.now()
+        for table, days in self.retention_days.items():
+            if not days:
+                continue
+            cutoff = (now - timedelta(days=days)).replace(
+                minute=0, second=0, microsecond=0)
+            if table == 'readings':
+                await self.rollup(cutoff)
+
+            deleted = 0
+            while True:
+                count = await asyncio.to_thread(
+                    self._execute, DELETE_OLD_ROWS[table],
+                    (cutoff.isoformat(), RETENTION_CHUNK_SIZE))
+                deleted += count
+                if count < RETENTION_CHUNK_SIZE:
+                    break
+                await asyncio.sleep(RETENTION_CHUNK_PAUSE)
+
+            if deleted:
+                logger.info('Pruned %d rows from %s', deleted, table)
+
+    async def rollup(self, cutoff) -> None:
+        oldest = self._con.execute(
+            SELECT_OLDEST_READING, (cutoff.isoformat(),)).fetchone()[0]
+        if oldest is None:
+            return
+
+        start = datetime.fromisoformat(oldest).replace(
+            minute=0, second=0, microsecond=0)
+        while start < cutoff:
+            end = min(start + ROLLUP_WINDOW, cutoff)
+            await asyncio.to_thread(
+                self._execute, INSERT_READINGS_HOURLY,
+                (start.isoformat(), end.isoformat()))
+            start = end
+            await asyncio.sleep(RETENTION_CHUNK_PAUSE)
+
+    async def vacuum(self) -> None:
+        while self.is_idle():
+            free = self._con.execute('PRAGMA freelist_count').fetchone()[0]
+            if not free:
+                return
+            await asyncio.to_thread(
+                self._execute,
+                f'PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})')
+            await asyncio.sleep(VACUUM_STEP_PAUSE)
+
+    def _execute(self, query, parameters=()):
+        with self._con:
+            cur = self._con.execute(query, parameters)
+            # incremental_vacuum выполняется по мере чтения результата
+            cur.fetchall()
+        return cur.rowcount
@@ -0,0 +1,63 @@
+import time
+
+# Насколько значение должно приблизиться к порогу, чтобы опрос
+# ускорился до минимального интервала
+PROXIMITY_MARGINS = {
+    'temperature': 1.0,
+    'humidity': 3.0,
+}
+# Во сколько раз интервал может вырасти за один шаг при затишье
+BACKOFF_FACTOR = 1.5
+
+
+class AdaptiveInterval:
+    """Интервал опроса от min_interval до max_interval.
+
+    Интервал сокращается, когда показание близко к порогу какого-либо
+    правила или быстро меняется, и плавно растёт, когда значения
+    стабильны и далеки от всех порогов.
+    """
+
+    def __init__(self, min_interval, max_interval):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = max_interval
+        self._previous = None
+        self._previous_at = None
+
+    def update(self, reading, thresholds, now=None):
+        now = time.monotonic() if now is None else now
+        urgency = 0.0
+
+        for parameter, margin in PROXIMITY_MARGINS.items():
+            current = reading.get(parameter)
+            if current is None:
+                continue
+
+            values = thresholds.get(parameter, ())
+            if values:
+                distance = min(abs(current - value) for value in values)
+                urgency = max(urgency, 1 - min(distance / margin, 1))
+
+            previous = (
+                self._previous.get(parameter)
+                if self._previous is not None else None
+            )
+            if previous is not None and now > self._previous_at:
+                rate = abs(current - previous) / (now - self._previous_at)
+                # Изменение за максимальный интервал при текущей скорости
+                urgency = max(
+                    urgency, min(rate * self.max_interval / margin, 1))
+
+        self._previous = reading
+        self._previous_at = now
+
+        target = (
+            self.min_interval +
+            (self.max_interval - self.min_interval) * (1 - urgency)
+        )
+        if target < self.interval:
+            self.interval = target
+        else:
+            self.interval = min(target, self.interval * BACKOFF_FACTOR)
+        return self.interval
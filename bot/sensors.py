@@ -1,12 +1,40 @@
+import logging
 import serial
 import serial.tools.list_ports
+import threading
 import time
 
+from filters import SensorFilter
+
+logger = logging.getLogger(__name__)
+
 SENSORS_READ_DELAY = 60
 
-_last_temperature = None
-_last_humidity = None
+# Показание считается устаревшим, если датчик не отвечал три периода
+SENSORS_STALE_AFTER = 3 * SENSORS_READ_DELAY
+
+# Паспортные диапазоны HTU21D
+TEMPERATURE_RANGE = (-40.0, 125.0)
+HUMIDITY_RANGE = (0.0, 100.0)
+
+# Таблица порогов в прошивке ограничена по памяти Nano
+FIRMWARE_MAX_RULES = 32
+FIRMWARE_PARAMETERS = {'temperature': 'T', 'humidity': 'H'}
+FIRMWARE_CONDITIONS = {'less': '<', 'equal': '=', 'greater': '>'}
+
+_temperature_filter = SensorFilter(
+    *TEMPERATURE_RANGE,
+    min_deviation=1.0,
+    stale_after=SENSORS_STALE_AFTER
+)
+_humidity_filter = SensorFilter(
+    *HUMIDITY_RANGE,
+    min_deviation=5.0,
+    stale_after=SENSORS_STALE_AFTER
+)
 _last_read_time = 0
+_read_delay = SENSORS_READ_DELAY
+_reader = None
 
 
 def find_arduino_port():
@@ -20,34 +48,148 @@ def find_arduino_port():
     return None
 
 
+def set_sample_interval(ser: serial.Serial, seconds: int):
+    """Просит прошивку присылать показания каждые seconds секунд."""
+    global _read_delay
+
+    _read_delay = seconds
+    send_command(ser, f'I:{seconds * 1000}')
+
+
+def send_command(ser: serial.Serial, command: str):
+    ser.write(f'{command}\n'.encode('ascii'))
+
+
+def threshold_table_commands(rules):
+    """Команды загрузки порогов в прошивку.
+
+    rules -- (parameter, condition, value); в прошивку попадают первые
+    FIRMWARE_MAX_RULES, остальные проверяются только ботом при опросе.
+    """
+    commands = ['C']
+    for parameter, condition, value in rules:
+        if len(commands) > FIRMWARE_MAX_RULES:
+            break
+        commands.append(
+            f'R:{FIRMWARE_PARAMETERS[parameter]}'
+            f'{FIRMWARE_CONDITIONS[condition]}{value:g}'
+        )
+    return commands
+
+
+def start_reader(ser: serial.Serial, on_alert=None):
+    """Читает порт в фоновом потоке.
+
+    Показания обновляются по мере прихода кадров от прошивки, чтение в
+    get_temperature()/get_humidity() больше не блокирует. on_alert
+    вызывается из потока чтения после кадра, который прошивка отправила
+    вне очереди из-за пересечения порога.
+    """
+    global _reader
+
+    _reader = threading.Thread(
+        target=_read_loop,
+        args=(ser, on_alert),
+        name='serial-reader',
+        daemon=True,
+    )
+    _reader.start()
+
+
+def _read_loop(ser: serial.Serial, on_alert):
+    global _last_read_time
+
+    temperature = None
+    humidity = None
+    alert = False
+    # Параметр, пересечение порога которого подтвердила прошивка
+    confirmed = None
+
+    while True:
+        try:
+            raw = ser.readline()
+        except Exception as error:
+            # Порт закрыт при остановке бота или отключён физически
+            logger.warning('Serial reader stopped: %s', error)
+            return
+
+        line = raw.decode('utf-8', errors='replace').strip()
+        if line.startswith("A:"):
+            # "A:<номер порога>:<T|H>"
+            alert = True
+            confirmed = line.split(':')[-1]
+        elif line.startswith("T:"):
+            temperature = _parse_value(line)
+        elif line.startswith("H:"):
+            humidity = _parse_value(line)
+
+        if temperature is not None and humidity is not None:
+            current_time = time.time()
+            _temperature_filter.update(
+                temperature, current_time, trusted=confirmed == 'T')
+            _humidity_filter.update(
+                humidity, current_time, trusted=confirmed == 'H')
+            _last_read_time = current_time
+            temperature = None
+            humidity = None
+
+            if alert and on_alert is not None:
+                on_alert()
+            alert = False
+            confirmed = None
+
+
+def _parse_value(line):
+    try:
+        return float(line[2:])
+    except ValueError:
+        return None
+
+
 def _update_sensor_data(ser: serial.Serial):
-    global _last_temperature, _last_humidity, _last_read_time
+    global _last_read_time
+
+    if _reader is not None:
+        return
 
     current_time = time.time()
-    if current_time - _last_read_time >= SENSORS_READ_DELAY:
+    if current_time - _last_read_time >= _read_delay:
         ser.reset_input_buffer()
         temperature = None
         humidity = None
 
         for _ in range(10):
-            line = ser.readline().decode('utf-8').strip()
+            line = ser.readline().decode('utf-8', errors='replace').strip()
             if line.startswith("T:"):
-                temperature = float(line[2:])
+                temperature = _parse_value(line)
             elif line.startswith("H:"):
-                humidity = float(line[2:])
+                humidity = _parse_value(line)
             if temperature is not None and humidity is not None:
                 break
 
-        _last_temperature = temperature if temperature else _last_temperature
-        _last_humidity = humidity if humidity else _last_humidity
+        _temperature_filter.update(temperature, current_time)
+        _humidity_filter.update(humidity, current_time)
         _last_read_time = current_time
 
 
 def get_temperature(ser: serial.Serial) -> float:
     _update_sensor_data(ser)
-    return _last_temperature
+    return _temperature_filter.current(time.time())
 
 
 def get_humidity(ser: serial.Serial) -> float:
     _update_sensor_data(ser)
-    return _last_humidity
+    return _humidity_filter.current(time.time())
+
+
+def get_read_time(ser: serial.Serial) -> float | None:
+    """Когда пришло последнее принятое фильтрами значение."""
+    times = [
+        updated_at
+        for updated_at in (
+            _temperature_filter.updated_at,
+            _humidity_filter.updated_at,
+        )
+        if updated_at is not None
+    ]
+    return max(times, default=None)
@@ -0,0 +1,93 @@
+"""Локальный MQTT-брокер для проверки моста без внешней инфраструктуры.
+
+Нужны amqtt и aiomqtt (pip install amqtt aiomqtt). Запуск:
+
+    python mqtt_broker.py --port 1883 --flap 30
+
+и в .env бота: MQTT_HOST=127.0.0.1, MQTT_PORT=1883
+
+Брокер печатает всё, что публикуется в sensors/#. С --flap он каждые
+N секунд то работает, то нет, чтобы проверить переподключение и буфер
+показаний на время обрыва. Правило можно передать, например, так:
+
+    python mqtt_broker.py --rule '{"action": "add", "user_id": 1,
+        "parameter": "temperature", "condition": "greater", "value": 30}'
+"""
+import argparse
+import asyncio
+
+import aiomqtt
+from amqtt.broker import Broker
+
+# Мост публикует в sensors/<id>/..., правила принимает в .../rules/set
+WATCH_TOPIC = 'sensors/#'
+RECONNECT_DELAY = 1
+
+
+def broker_config(host, port):
+    return {
+        'listeners': {
+            'default': {'type': 'tcp', 'bind': f'{host}:{port}'},
+        },
+        'auth': {'allow-anonymous': True},
+        'topic-check': {'enabled': False},
+    }
+
+
+async def watch(host, port, sensor_id, rule):
+    """Печатает сообщения брокера.
+
+    rule отправляется после первого показания от моста: к этому моменту
+    мост уже подписан на rules/set и не пропустит сообщение.
+    """
+    while True:
+        try:
+            async with aiomqtt.Client(host, port) as client:
+                await client.subscribe(WATCH_TOPIC, qos=1)
+                async for message in client.messages:
+                    retained = ' (retained)' if message.retain else ''
+                    print(f'{message.topic}: '
+                          f'{message.payload.decode()}{retained}')
+                    if rule is not None and not message.retain:
+                        await client.publish(
+                            f'sensors/{sensor_id}/rules/set', rule, qos=1)
+                        rule = None
+        except aiomqtt.MqttError:
+            await asyncio.sleep(RECONNECT_DELAY)
+
+
+async def serve(host, port, flap, sensor_id, rule):
+    watcher = asyncio.create_task(watch(host, port, sensor_id, rule))
+    try:
+        while True:
+            # Остановленный amqtt не запускается повторно, поэтому на
+            # каждый период работы создаётся новый брокер
+            broker = Broker(broker_config(host, port))
+            await broker.start()
+            print(f'broker is up on {host}:{port}')
+            if not flap:
+                await asyncio.Event().wait()
+
+            await asyncio.sleep(flap)
+            await broker.shutdown()
+            print('broker is down')
+            await asyncio.sleep(flap)
+    finally:
+        watcher.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальный MQTT-брокер')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--flap', type=float, default=0,
+                        help='переключать доступность каждые N секунд')
+    parser.add_argument('--sensor-id', default='nano')
+    parser.add_argument('--rule', help='JSON изменения правила')
+    args = parser.parse_args()
+    asyncio.run(serve(
+        args.host, args.port, args.flap, args.sensor_id, args.rule))
+
+
+if __name__ == '__main__':
+    main()
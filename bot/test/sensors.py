@@ -5,13 +5,29 @@ SENSORS_READ_DELAY = 1
 
 _last_temperature = None
 _last_humidity = None
-_last_read_time = 0
+_last_read_time = None
 
 
 def find_arduino_port():
     return None
 
 
+def set_sample_interval(_=None, seconds=None):
+    pass
+
+
+def send_command(_=None, command=None):
+    pass
+
+
+def threshold_table_commands(rules):
+    return []
+
+
+def start_reader(_=None, on_alert=None):
+    pass
+
+
 def _generate_fake_sensor_data():
     temperature = round(random.uniform(18.0, 30.0), 1)
     humidity = round(random.uniform(30.0, 70.0), 1)
@@ -22,7 +38,10 @@ def _update_sensor_data(_=None):
     global _last_temperature, _last_humidity, _last_read_time
 
     current_time = time.time()
-    if current_time - _last_read_time >= SENSORS_READ_DELAY:
+    if (
+        _last_read_time is None
+        or current_time - _last_read_time >= SENSORS_READ_DELAY
+    ):
         temperature, humidity = _generate_fake_sensor_data()
 
         _last_temperature = temperature
@@ -38,3 +57,9 @@ def get_temperature(_=None) -> float:
 def get_humidity(_=None) -> float:
     _update_sensor_data()
     return _last_humidity
+
+
+def get_read_time(_=None) -> float:
+    # Кадр "приходит" при опросе, как только прошла SENSORS_READ_DELAY
+    _update_sensor_data()
+    return _last_read_time
@@ -0,0 +1,85 @@
+"""Заглушка Telegram Bot API для проверки доставки без сети.
+
+Запуск:
+
+    python telegram_stub.py --port 8081 --flap 30
+
+и в .env бота: TELEGRAM_API_URL=http://127.0.0.1:8081
+
+С --flap заглушка каждые N секунд то принимает соединения, то нет,
+имитируя недоступность Telegram. Отправленные сообщения печатаются.
+"""
+import argparse
+import asyncio
+import time
+
+from aiohttp import web
+
+STUB_USER = {
+    'id': 1,
+    'is_bot': True,
+    'first_name': 'stub',
+    'username': 'stub_bot',
+}
+
+
+class TelegramStub:
+    def __init__(self):
+        self.message_id = 0
+        self.app = web.Application()
+        self.app.router.add_post('/bot{token}/{method}', self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method'].lower()
+        data = await request.post()
+
+        match method:
+            case 'getme':
+                result = STUB_USER
+            case 'getupdates':
+                await asyncio.sleep(min(float(data.get('timeout', 0)), 10))
+                result = []
+            case 'sendmessage':
+                self.message_id += 1
+                print(f'-> {data["chat_id"]}: {data["text"]}')
+                result = {
+                    'message_id': self.message_id,
+                    'date': int(time.time()),
+                    'chat': {'id': int(data['chat_id']), 'type': 'private'},
+                    'text': data['text'],
+                }
+            case _:
+                result = True
+
+        return web.json_response({'ok': True, 'result': result})
+
+
+async def serve(host, port, flap):
+    runner = web.AppRunner(TelegramStub().app)
+    await runner.setup()
+
+    while True:
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        print(f'stub is up on {host}:{port}')
+        if not flap:
+            await asyncio.Event().wait()
+
+        await asyncio.sleep(flap)
+        await site.stop()
+        print('stub is down')
+        await asyncio.sleep(flap)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Заглушка Telegram Bot API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--flap', type=float, default=0,
+                        help='переключать доступность каждые N секунд')
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.flap))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,105 @@
 
 HTU21D sensor;
 
+const unsigned long minInterval = 1000;     // 1 секунда
+const unsigned long maxInterval = 60000;    // 60 секунд
+const unsigned long sampleInterval = 1000;  // замер при наличии порогов
+// Пересечение засчитывается, если держится столько замеров подряд:
+// одиночный выброс датчика не будит бота
+const uint8_t debounceSamples = 2;
+// Точность условия "равна", как EQUAL_TOLERANCE в боте
+const float equalTolerance = 0.01;
+
 unsigned long previousMillis = 0;
-const unsigned long interval = 60000;  // 60 секунд
+unsigned long previousSampleMillis = 0;
+unsigned long interval = maxInterval;
+
+// Пороги, загруженные ботом. state: -1 -- ещё не проверялся,
+// 0/1 -- подтверждённое состояние; streak -- сколько замеров подряд
+// состояние отличается от подтверждённого
+struct Rule {
+    char parameter;  // 'T' или 'H'
+    char condition;  // '<', '=' или '>'
+    float value;
+    int8_t state;
+    uint8_t streak;
+};
+
+const uint8_t maxRules = 32;
+Rule rules[maxRules];
+uint8_t ruleCount = 0;
+
+// Команды от бота построчно:
+//   "I:<мс>"           -- интервал отправки показаний
+//   "C"                -- очистить таблицу порогов
+//   "R:<T|H><op><value>" -- добавить порог, например "R:T>30"
+char command[32];
+uint8_t commandLength = 0;
+
+void handleCommand() {
+    if (strncmp(command, "I:", 2) == 0) {
+        unsigned long value = strtoul(command + 2, NULL, 10);
+        interval = constrain(value, minInterval, maxInterval);
+    } else if (strcmp(command, "C") == 0) {
+        ruleCount = 0;
+    } else if (strncmp(command, "R:", 2) == 0 && ruleCount < maxRules) {
+        rules[ruleCount].parameter = command[2];
+        rules[ruleCount].condition = command[3];
+        rules[ruleCount].value = atof(command + 4);
+        rules[ruleCount].state = -1;
+        rules[ruleCount].streak = 0;
+        ruleCount++;
+    }
+}
+
+void readCommands() {
+    while (Serial.available()) {
+        char c = Serial.read();
+        if (c == '\n') {
+            command[commandLength] = '\0';
+            handleCommand();
+            commandLength = 0;
+        } else if (c != '\r' && commandLength < sizeof(command) - 1) {
+            command[commandLength++] = c;
+        }
+    }
+}
+
+bool isTriggered(const Rule &rule, float temperature, float humidity) {
+    float current = rule.parameter == 'T' ? temperature : humidity;
+    switch (rule.condition) {
+        case '<':
+            return current < rule.value;
+        case '>':
+            return current > rule.value;
+        default:
+            return fabs(current - rule.value) < equalTolerance;
+    }
+}
+
+// Номер первого порога, пересечение которого подтвердилось на этом
+// замере, или -1
+int checkRules(float temperature, float humidity) {
+    int crossed = -1;
+    for (uint8_t i = 0; i < ruleCount; i++) {
+        Rule &rule = rules[i];
+        bool triggered = isTriggered(rule, temperature, humidity);
+        if (rule.state < 0 || triggered == rule.state) {
+            rule.state = triggered;
+            rule.streak = 0;
+            continue;
+        }
+        if (++rule.streak < debounceSamples) {
+            continue;
+        }
+        rule.state = triggered;
+        rule.streak = 0;
+        if (triggered && crossed < 0) {
+            crossed = i;
+        }
+    }
+    return crossed;
+}
 
 void setup() {
     Serial.begin(9600);
@@ -12,18 +109,34 @@ void setup() {
 }
 
 void loop() {
+    readCommands();
+
     unsigned long currentMillis = millis();
-    if (currentMillis - previousMillis >= interval) {
-        previousMillis = currentMillis;
+    unsigned long sampleEvery = ruleCount ? sampleInterval : interval;
+    if (currentMillis - previousSampleMillis < sampleEvery) {
+        return;
+    }
+    previousSampleMillis = currentMillis;
 
-        if (sensor.measure()) {
-            float temperature = sensor.getTemperature();
-            float humidity = sensor.getHumidity();
+    if (sensor.measure()) {
+        float temperature = sensor.getTemperature();
+        float humidity = sensor.getHumidity();
+
+        int crossed = checkRules(temperature, humidity);
+        if (crossed < 0 && currentMillis - previousMillis < interval) {
+            return;
+        }
+        previousMillis = currentMillis;
 
-            Serial.print("T:");
-            Serial.println(temperature, 2);
-            Serial.print("H:");
-            Serial.println(humidity, 2);
+        if (crossed >= 0) {
+            Serial.print("A:");
+            Serial.print(crossed);
+            Serial.print(':');
+            Serial.println(rules[crossed].parameter);
         }
+        Serial.print("T:");
+        Serial.println(temperature, 2);
+        Serial.print("H:");
+        Serial.println(humidity, 2);
     }
 }